@@ -1,70 +1,871 @@
 #!/usr/bin/env python3
 
-import numpy
+import contextlib
+import functools
+import hashlib
+import importlib
 import json
-import sh
 import os
 import pprint
-from collections import defaultdict, Counter, OrderedDict
+import resource
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict, OrderedDict
 from termcolor import cprint
 
+class LazyModule:
+    # Stands in for a module until one of its attributes is first used, so
+    # quick commands like --help or load_results don't pay to import it
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.name), attr)
+
+inspect = LazyModule('inspect')
+numpy = LazyModule('numpy')
+sandbox = LazyModule('sandbox')
+sh = LazyModule('sh')
+
+# How much of a submission's history a TestCase needs, cheapest first
+HISTORY_HEAD = 0
+HISTORY_BLOBLESS = 1
+HISTORY_FULL = 2
+
+CLONE_ARGS = {
+    HISTORY_HEAD: ['--depth', '1'],
+    HISTORY_BLOBLESS: ['--filter=blob:none'],
+    HISTORY_FULL: [],
+}
+
+# a blobless clone remembers its filter, so only depth needs repeating
+FETCH_ARGS = {
+    HISTORY_HEAD: ['--depth', '1'],
+    HISTORY_BLOBLESS: [],
+    HISTORY_FULL: [],
+}
+
+def head_sha(repo_path):
+    try:
+        return str(sh.git('-C', repo_path, 'rev-parse', '--verify', '-q', 'HEAD')).strip()
+    except sh.ErrorReturnCode:
+        # empty repo, or not a repo at all
+        return None
+
+def tree_sha(repo_path):
+    try:
+        return str(sh.git('-C', repo_path, 'rev-parse', '--verify', '-q', 'HEAD^{tree}')).strip()
+    except sh.ErrorReturnCode:
+        return None
+
+def cache_key(repo_path, history):
+    # What a test case's result can depend on: HEAD's tree, or HEAD's commit,
+    # which pins the whole history, for test cases that look at history
+    if history > HISTORY_HEAD:
+        return head_sha(repo_path)
+    return tree_sha(repo_path)
+
+# st_dev -> whether that filesystem can make reflinks
+_reflinks = {}
+
+def copy_checkout(src, dst):
+    # Copy the checkout at src to dst as cheaply as the filesystem allows:
+    # reflinks of everything where supported (btrfs, XFS), otherwise a real
+    # copy of the working tree with git's objects, which git never changes
+    # once written, hardlinked.
+    dev = os.stat(src).st_dev
+    if _reflinks.get(dev, True):
+        try:
+            sh.cp('-a', '--reflink=always', src, dst)
+            _reflinks[dev] = True
+            return
+        except sh.ErrorReturnCode:
+            _reflinks[dev] = False
+            shutil.rmtree(dst, ignore_errors=True)
+
+    objects = os.path.join(src, '.git', 'objects')
+
+    def copy(s, d):
+        if s.startswith(objects + os.sep):
+            try:
+                os.link(s, d)
+                return d
+            except OSError:
+                pass
+        return shutil.copy2(s, d)
+    shutil.copytree(src, dst, symlinks=True, copy_function=copy)
+
+@contextlib.contextmanager
+def snapshot(repo_path):
+    # A throwaway copy of the checkout at repo_path, next to it so hardlinks
+    # and reflinks work, for running something that may write to it. Keeps
+    # the repo's directory name.
+    repo_path = os.path.abspath(repo_path)
+    parent = tempfile.mkdtemp(prefix='.{}-snapshot-'.format(os.path.basename(repo_path)),
+            dir=os.path.dirname(repo_path))
+    path = os.path.join(parent, os.path.basename(repo_path))
+    try:
+        copy_checkout(repo_path, path)
+        yield path
+    finally:
+        shutil.rmtree(parent, ignore_errors=True)
+
+def fingerprint(test_case):
+    # Hash the source of the test case and everything it inherits from, plus
+    # whatever module-level names their code refers to: constants (e.g. probe
+    # scripts) by value, and functions and classes from the same module by
+    # source, following what those refer to in turn. Returns None if some
+    # source isn't available, which disables caching.
+    h = hashlib.sha1()
+    seen = set()
+
+    def visit_code(code, module):
+        for name in code.co_names:
+            visit(getattr(module, name, None), module)
+        # nested functions, lambdas and comprehensions
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                visit_code(const, module)
+
+    def visit(value, module):
+        if isinstance(value, (str, bytes, int, float)):
+            h.update(repr(value).encode('utf-8'))
+            return
+        if not (inspect.isfunction(value) or inspect.isclass(value)):
+            return
+        if value in seen or getattr(value, '__module__', None) != module.__name__:
+            return
+        seen.add(value)
+        h.update(inspect.getsource(value).encode('utf-8'))
+        if inspect.isclass(value):
+            for attr in vars(value).values():
+                if isinstance(attr, property):
+                    attr = attr.fget
+                # through decorators like fixture, to the function's own code
+                code = getattr(inspect.unwrap(attr), '__code__', None)
+                if code is not None:
+                    visit_code(code, module)
+        else:
+            visit_code(inspect.unwrap(value).__code__, module)
+
+    try:
+        for cls in type(test_case).__mro__[:-1]:
+            visit(cls, sys.modules.get(cls.__module__))
+    except (OSError, TypeError):
+        return None
+    return h.hexdigest()
+
+class ResultCache:
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+
+    def _path(self, key, test_case):
+        cls = type(test_case)
+        if cls not in self.fingerprints:
+            self.fingerprints[cls] = fingerprint(test_case)
+        if self.fingerprints[cls] is None:
+            return None
+        return os.path.join(self.path, key, '{}.{}-{}.json'.format(
+            cls.__module__, cls.__qualname__, self.fingerprints[cls]))
+
+    def get(self, key, test_case):
+        path = self._path(key, test_case)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return TestCaseResult(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def put(self, key, test_case, result):
+        path = self._path(key, test_case)
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so parallel graders never see half a file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(result.to_dict(), f)
+        os.replace(tmp, path)
+
+def check_access(url, history=HISTORY_FULL, timeout=120):
+    # What the autograder can see of a repo without cloning it: ls-remote for
+    # access, then only the commit objects (no trees or blobs), all of them
+    # if the test cases need history, to report HEAD and a commit count
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    result = {'url': url, 'error': None, 'head': None, 'summary': None, 'date': None,
+        'commits': None}
+    try:
+        if not str(sh.git('ls-remote', url, 'HEAD', _env=env, _timeout=timeout)).strip():
+            # reachable, but nothing pushed
+            return result
+
+        with tempfile.TemporaryDirectory(prefix='autograder-preflight-') as scratch:
+            sh.git('init', '-q', '--bare', scratch)
+            depth = ['--depth', '1'] if history == HISTORY_HEAD else []
+            sh.git('-C', scratch, 'fetch', '-q', '--filter=tree:0', *depth, url, 'HEAD',
+                    _env=env, _timeout=timeout)
+            head, date, message = str(sh.git('-C', scratch, 'log', '-1',
+                '--format=%H%x1f%aI%x1f%B', 'FETCH_HEAD', _tty_out=False)).split('\x1f', 2)
+            result.update(head=head, date=date, summary=message.strip())
+            if history != HISTORY_HEAD:
+                result['commits'] = int(str(sh.git('-C', scratch, 'rev-list', '--count',
+                    'FETCH_HEAD', _tty_out=False)))
+    except sh.ErrorReturnCode as e:
+        result['error'] = e.stderr.decode('utf-8')
+    except sh.TimeoutException:
+        result['error'] = 'Timed out after {} seconds'.format(timeout)
+    return result
+
+class ReferenceMirror:
+    # A bare repo holding the starter history that student repos are forked
+    # from. Clones borrow its objects through git alternates, so each one
+    # only downloads and stores what the student added. Starter refs live
+    # under refs/remotes/<repo name>/, refs taken from a first clone under
+    # refs/seeds/<repo name>/, and nothing ever deletes them: clones depend
+    # on the objects they keep alive. A force-pushed starter would move its
+    # refs/remotes/ ref off history clones still borrow, so refresh() first
+    # pins every old tip under refs/keep/<repo name>/<sha>.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seeded = set()
+
+    @staticmethod
+    def key(name):
+        return 'default' if name is None else name
+
+    def init(self):
+        if not os.path.isdir(self.path):
+            sh.git('init', '-q', '--bare', self.path)
+
+    def has(self, name):
+        key = self.key(name)
+        return bool(str(sh.git('-C', self.path, 'for-each-ref', '--count=1',
+            'refs/remotes/{}/'.format(key), 'refs/seeds/{}/'.format(key))).strip())
+
+    def add_starter(self, url, name=None):
+        # fetched the first time only, refresh() keeps it up to date
+        key = self.key(name)
+        with self.lock:
+            self.init()
+            if key in str(sh.git('-C', self.path, 'remote')).split():
+                sh.git('-C', self.path, 'remote', 'set-url', key, url)
+            else:
+                sh.git('-C', self.path, 'remote', 'add', key, url)
+            if not self.has(name):
+                sh.git('-C', self.path, 'fetch', '-q', '--no-tags', key)
+            self.seeded.add(key)
+
+    def absorb(self, repo_path, name=None):
+        # seed from a full clone if nothing has been seeded for this repo yet
+        key = self.key(name)
+        with self.lock:
+            if key in self.seeded:
+                return
+            self.init()
+            if not self.has(name):
+                sh.git('-C', self.path, 'fetch', '-q', '--no-tags', repo_path,
+                        '+HEAD:refs/seeds/{}/first-clone'.format(key))
+            self.seeded.add(key)
+
+    def clone_args(self):
+        return ['--reference-if-able', self.path]
+
+    def refresh(self):
+        tips = str(sh.git('-C', self.path, 'for-each-ref',
+            '--format=%(objectname) %(refname)', 'refs/remotes/')).split('\n')
+        pins = ''
+        for line in filter(None, tips):
+            sha, ref = line.split(' ', 1)
+            pins += 'update refs/keep/{}/{} {}\n'.format(ref.split('/')[2], sha, sha)
+        if pins:
+            sh.git('-C', self.path, 'update-ref', '--stdin', _in=pins)
+        sh.git('-C', self.path, 'fetch', '-q', '--all', '--no-tags')
+
+    def gc(self):
+        # only unreachable objects go, and refresh() keeps every starter tip
+        # clones might have borrowed from reachable; but don't run it while
+        # cloning
+        sh.git('-C', self.path, 'gc', '-q', '--prune=now')
+
+    def usage(self):
+        return str(sh.git('-C', self.path, 'count-objects', '-vH'))
+
+# process groups of the TestCase.commands running right now
+_command_groups = set()
+_command_groups_lock = threading.Lock()
+
+def kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+# per-submission fixture values, emptied by TestRunner after each submission
+_fixtures = {}
+# a lock per fixture key, so concurrent test cases compute each one once
+_fixture_locks = {}
+_fixture_locks_lock = threading.Lock()
+
+def fixture(func):
+    # Memoize an expensive func(self, submission) for the submission being
+    # graded, so every test case sharing it pays for it once. Exceptions are
+    # remembered too, and re-raised to each test case that asks. Asked from
+    # a snapshot, it's computed on (and shared with) the checkout itself, so
+    # func mustn't write to it.
+    @functools.wraps(func)
+    def wrapper(self, submission):
+        if self.snapshot and submission == self.snapshot[0]:
+            submission = self.snapshot[1]
+        key = (func, submission)
+        with _fixture_locks_lock:
+            lock = _fixture_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in _fixtures:
+                try:
+                    _fixtures[key] = (func(self, submission), None)
+                except Exception as e:
+                    _fixtures[key] = (None, e)
+        value, exc = _fixtures[key]
+        if exc is not None:
+            raise exc
+        return value
+    return wrapper
+
 class ImmutableDict(OrderedDict):
     def __setitem__(self, key, value):
         if key in self:
             raise LookupError('{} already returned'.format(key))
         OrderedDict.__setitem__(self, key, value)
 
+    def replace(self, key, value):
+        # for when overwriting is the point, e.g. a regrade
+        OrderedDict.__setitem__(self, key, value)
+
+# additional_text longer than this is kept zlib-compressed in _texts, once
+# per distinct text, and only decompressed when read
+LARGE_TEXT = 4096
+
+# sha1 digest -> compressed text, shared by every result with that text
+_texts = {}
+
 class TestCaseResult:
-    def __init__(self, message, score, points_possible, additional_text=''):
-        self.message = message
+    __slots__ = ('message', 'score', 'points_possible', '_text', 'rusage', 'timing')
+
+    def __init__(self, message, score, points_possible, additional_text='', rusage=None,
+            timing=None):
+        # thousands of results share a handful of messages
+        self.message = sys.intern(message)
         self.score = float(score)
         self.points_possible = float(points_possible)
         self.additional_text = additional_text
+        # {'cpu': seconds, 'max_rss': kilobytes or None} of the processes the
+        # test ran
+        self.rusage = rusage
+        # {'wall': seconds, 'cpu': seconds} for running the test case,
+        # cpu being ours plus our children's
+        self.timing = timing
+
+    @property
+    def additional_text(self):
+        if isinstance(self._text, bytes):
+            return zlib.decompress(_texts[self._text]).decode('utf-8')
+        return self._text
+
+    @additional_text.setter
+    def additional_text(self, text):
+        if text is None or len(text) <= LARGE_TEXT:
+            self._text = text and sys.intern(text)
+            return
+        encoded = text.encode('utf-8')
+        digest = hashlib.sha1(encoded).digest()
+        if digest not in _texts:
+            _texts[digest] = zlib.compress(encoded)
+        self._text = digest
+
+    def to_dict(self):
+        return {
+            'message': self.message,
+            'score': self.score,
+            'points_possible': self.points_possible,
+            'additional_text': self.additional_text,
+            'rusage': self.rusage,
+            'timing': self.timing,
+        }
+
+    # pickled (e.g. back from a grading process) as its dict form, so the
+    # text lands in the receiving process's _texts
+    def __reduce__(self):
+        return (_result_from_dict, (self.to_dict(),))
 
     def __repr__(self):
         return self.message
 
+def _result_from_dict(d):
+    return TestCaseResult(**d)
+
 class TestCase:
+    history = HISTORY_FULL
+    # which repo of a multi-repo submission to test, None for single-repo ones
+    repo = None
+
+    # Limits for everything run through self.command. The timeout is wall-clock
+    # seconds for the whole test case, the rest are per-process rlimits.
+    timeout = 60
+    cpu_limit = 30
+    memory_limit = 2 * 1024**3
+    process_limit = 1024
+
+    deadline = None
+    # rusage of each probe run during the current test(), set by TestRunner;
+    # probes are the zygote's children, not ours
+    probe_usage = None
+
+    # set if the test case runs submission Python through self.probe, so the
+    # shared interpreter pool is warmed up before grading starts
+    sandbox = False
+    # set if test() may ask us something on stdin, which a forked grading
+    # process can't do (its stdin is /dev/null)
+    interactive = False
+
+    # Test case classes that have to pass first; if one of them doesn't, this
+    # test case is skipped and scores 0. Ones not being run are ignored.
+    requires = ()
+    # Set if test() leaves the repo and process alone (no writing files,
+    # sh.pushd or os.chdir), so it can run alongside the submission's other
+    # read-only test cases. Their rusage then includes each other's. Other
+    # test cases are given a snapshot of the checkout, thrown away after.
+    read_only = False
+    # (snapshot path, checkout path) while test() runs in a snapshot, set by
+    # TestRunner
+    snapshot = None
+
     def __repr__(self):
         return self.__class__.__name__
 
     def result(self, message, score, additional_text=None):
+        if additional_text and self.snapshot:
+            # students should see their repo, not our throwaway copy of it
+            additional_text = additional_text.replace(*self.snapshot)
         return TestCaseResult(message, float(score), self.points_possible, additional_text)
 
+    def apply_limits(self):
+        # runs in the child between fork and exec
+        # hard limit a second later, so the child sees SIGXCPU rather than SIGKILL
+        resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_limit, self.cpu_limit + 1))
+        resource.setrlimit(resource.RLIMIT_AS, (self.memory_limit, self.memory_limit))
+        resource.setrlimit(resource.RLIMIT_NPROC, (self.process_limit, self.process_limit))
+
+    def remaining(self):
+        if self.deadline is None:
+            return self.timeout
+        return max(self.deadline - time.monotonic(), 0.1)
+
+    def command(self, name):
+        # A function running the sh.Command name(*args, **kwargs) on submission
+        # code under this test case's limits, returning it once it's done. sh
+        # starts it in a process group of its own, and whatever it leaves
+        # behind there (background jobs, or everything after a timeout,
+        # which sh only delivers to the command itself) is killed once it
+        # exits.
+        baked = sh.Command(name).bake(_timeout=self.remaining(),
+                _preexec_fn=self.apply_limits, _new_session=False, _bg=True,
+                _bg_exc=False)
+
+        def run(*args, **kwargs):
+            running = baked(*args, **kwargs)
+            with _command_groups_lock:
+                _command_groups.add(running.pid)
+            try:
+                running.wait()
+                return running
+            finally:
+                with _command_groups_lock:
+                    _command_groups.discard(running.pid)
+                kill_group(running.pid)
+        return run
+
+    def probe(self, repo_path, source=None, func='probe', args=(), script=None):
+        # Run submission Python in a warm interpreter from the sandbox pool,
+        # under this test case's limits: either func(*args) from source, or
+        # the script file as __main__. Returns the sandbox's result dict.
+        result = sandbox.pool().run(repo_path, source, func, args, script,
+                timeout=self.remaining(), cpu=self.cpu_limit, memory=self.memory_limit,
+                nproc=self.process_limit)
+        if self.probe_usage is not None:
+            self.probe_usage.append(result['rusage'])
+        return result
+
+    def passed(self, result):
+        # whether result lets test cases that require this one run
+        return result.score >= result.points_possible
+
     def test(self, submission):
         raise NotImplementedError('Subclasses must override this')
 
 class TestRunner:
-    def __init__(self, test_cases, logger=lambda *args: None):
+    def __init__(self, test_cases, logger=lambda *args: None, cache=None, jobs=4):
         self.test_cases = test_cases
         self.log = logger
+        self.cache = cache
+        # read-only test cases of one submission to run at once
+        self.jobs = jobs
+        self.prerequisites = self.find_prerequisites(test_cases)
 
-    def test_submission(self, submission):
-        result = ImmutableDict()
+    @staticmethod
+    def find_prerequisites(test_cases):
+        # test case -> the test cases it requires, in test_cases order
+        prerequisites = {
+            test_case: [other for other in test_cases if other is not test_case and
+                isinstance(other, tuple(test_case.requires))]
+            for test_case in test_cases
+        }
+        done = set()
+        while len(done) < len(test_cases):
+            ready = [tc for tc in test_cases if tc not in done and
+                all(p in done for p in prerequisites[tc])]
+            if not ready:
+                raise ValueError('Test cases require each other: {}'.format(
+                    ', '.join(str(tc) for tc in test_cases if tc not in done)))
+            done.update(ready)
+        return prerequisites
 
-        for test_case in self.test_cases:
-            key = str(test_case)
+    @staticmethod
+    def child_usage(before, probes=()):
+        # Usage of the children reaped since `before`, plus that of the probes
+        # run meanwhile. For children the kernel only keeps the max RSS of the
+        # largest one reaped so far, which needn't be one of these, so max_rss
+        # only covers probes (None if there weren't any).
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        usage = None
+        if after.ru_minflt != before.ru_minflt:
+            usage = {
+                'cpu': (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+                'max_rss': None,
+            }
+        for probe in probes:
+            usage = {
+                'cpu': (usage['cpu'] if usage else 0.) + probe['cpu'],
+                'max_rss': max((usage or {}).get('max_rss') or 0, probe['max_rss']),
+            }
+        return usage
+
+    def test_submission(self, submission, clone_errors=None):
+        # submission is a repo path, or {name: path} for multi-repo submissions,
+        # in which case clone_errors maps any repo that failed to clone to why
+        try:
+            return self._test_submission(submission, clone_errors or {})
+        finally:
+            _fixtures.clear()
+            _fixture_locks.clear()
+
+    def run_test_case(self, test_case, repo_path, key=None):
+        # returns the result, and whether it came from the cache under key
+        wall, cpu = time.monotonic(), time.thread_time()
+        cached = self.cache.get(key, test_case) if key else None
+        if cached:
+            cached.timing = {'wall': time.monotonic() - wall, 'cpu': time.thread_time() - cpu}
+            return cached, True
+
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        test_case.probe_usage = []
+        test_case.deadline = time.monotonic() + test_case.timeout
+        try:
+            result = test_case.test(repo_path)
+            if key:
+                self.cache.put(key, test_case, result)
+        except (sh.TimeoutException, sandbox.Timeout):
+            result = test_case.result('Timed out', 0,
+                    additional_text='Ran longer than {} seconds'.format(test_case.timeout))
+        except (sh.SignalException_SIGXCPU, sandbox.CPULimit):
+            result = test_case.result('Timed out', 0,
+                    additional_text='Used more than {} seconds of CPU time'.format(
+                        test_case.cpu_limit))
+        except sh.ErrorReturnCode as e:
+            result = test_case.result('Uncaught shell exception', 0,
+                    additional_text=e.stderr.decode('utf-8'))
+        except Exception as e:
+            result = test_case.result('Uncaught exception', 0,
+                    additional_text=str(e))
+        finally:
+            test_case.deadline = None
+
+        result.rusage = self.child_usage(usage, test_case.probe_usage)
+        test_case.probe_usage = None
+        result.timing = {
+            'wall': time.monotonic() - wall,
+            'cpu': time.thread_time() - cpu + (result.rusage['cpu'] if result.rusage else 0.),
+        }
+        return result, False
+
+    def _test_submission(self, submission, clone_errors):
+        from concurrent.futures import ThreadPoolExecutor
+
+        def repo_path(test_case):
+            return submission if test_case.repo is None else submission[test_case.repo]
+
+        # (repo path, whether history matters) -> cache key
+        keys = {}
+        if self.cache:
+            for test_case in self.test_cases:
+                at = (repo_path(test_case), test_case.history > HISTORY_HEAD)
+                if test_case.repo not in clone_errors and at not in keys:
+                    keys[at] = cache_key(repo_path(test_case), test_case.history)
+
+        def run(test_case):
+            if test_case.repo in clone_errors:
+                return test_case.result('Failed to clone {}'.format(test_case.repo), 0,
+                        additional_text=clone_errors[test_case.repo]), False
+            key = keys.get((repo_path(test_case), test_case.history > HISTORY_HEAD))
+            if test_case.read_only:
+                return self.run_test_case(test_case, repo_path(test_case), key)
             try:
-                result[key] = test_case.test(submission)
-            except sh.ErrorReturnCode as e:
-                result[key] = test_case.result('Uncaught shell exception', 0,
-                        additional_text=e.stderr.decode('utf-8'))
-            except Exception as e:
-                result[key] = test_case.result('Uncaught exception', 0,
-                        additional_text=str(e))
+                with snapshot(repo_path(test_case)) as path:
+                    test_case.snapshot = (path, repo_path(test_case))
+                    try:
+                        return self.run_test_case(test_case, path, key)
+                    finally:
+                        test_case.snapshot = None
+            except OSError as e:
+                # out of disk and the like; run_test_case catches the rest
+                return test_case.result('Failed to snapshot', 0, additional_text=str(e)), False
+
+        # Run in waves of test cases whose prerequisites are done: the
+        # read-only ones of a wave concurrently, then the rest one by one.
+        outcomes = {}
+        pending = list(self.test_cases)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending:
+                ready = [tc for tc in pending if
+                    all(p in outcomes for p in self.prerequisites[tc])]
+                pending = [tc for tc in pending if tc not in ready]
 
-            self.log('{}: {} [{}/{}]'.format(test_case, result[key],
-                result[key].score, float(test_case.points_possible)))
+                batch = []
+                for test_case in ready:
+                    failed = [p for p in self.prerequisites[test_case]
+                        if not p.passed(outcomes[p][0])]
+                    if failed and test_case.repo not in clone_errors:
+                        outcomes[test_case] = test_case.result('Prerequisite failed', 0,
+                                additional_text='Needs {} to pass'.format(
+                                    ', '.join(str(p) for p in failed))), False
+                    else:
+                        batch.append(test_case)
 
-            if result[key].additional_text:
-                self.log(result[key].additional_text, indent=4, color='red')
+                concurrent = [tc for tc in batch if tc.read_only] if self.jobs > 1 else []
+                for test_case, outcome in zip(concurrent, executor.map(run, concurrent)):
+                    outcomes[test_case] = outcome
+                for test_case in batch:
+                    if test_case not in outcomes:
+                        outcomes[test_case] = run(test_case)
 
+                for test_case in ready:
+                    self.log_result(test_case, *outcomes[test_case])
+
+        result = ImmutableDict()
+        for test_case in self.test_cases:
+            result[str(test_case)] = outcomes[test_case][0]
         return result
 
+    def log_result(self, test_case, result, cached):
+        self.log('{}: {} [{}/{}]{}'.format(test_case, result, result.score,
+            float(test_case.points_possible), ' (cached)' if cached else ''))
+        if result.additional_text:
+            self.log(result.additional_text, indent=4, color='red')
+
+def result_entry(result, clone_seconds=None):
+    # one submission's results in results.json form
+    entry = {
+        'score': sum([r.score for _, r in result.items()]),
+        'test_case_results': {k: v.to_dict() for k, v in result.items()},
+    }
+    if clone_seconds is not None:
+        entry['clone_seconds'] = clone_seconds
+    return entry
+
+def read_log(path):
+    # Stream (uniq, entry) pairs from a JSON Lines results log. A torn last
+    # line from a run that was killed mid-write is skipped.
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            yield entry.pop('uniq'), entry
+
+class ResultTable:
+    # Results in columnar form, one row per (submission, test case) result,
+    # for stats over cohorts too large to walk result by result. Messages
+    # are interned, so each row stores an index into self.messages.
+    def __init__(self, uniqs, tests, messages, uniq_idx, test_idx, message_id, score,
+            points_possible, grades):
+        self.uniqs = uniqs
+        self.tests = tests
+        self.messages = messages
+        self.uniq_idx = numpy.asarray(uniq_idx, dtype=numpy.int32)
+        self.test_idx = numpy.asarray(test_idx, dtype=numpy.int32)
+        self.message_id = numpy.asarray(message_id, dtype=numpy.int32)
+        self.score = numpy.asarray(score, dtype=numpy.float64)
+        self.points_possible = numpy.asarray(points_possible, dtype=numpy.float64)
+        # per uniq, in the order of self.uniqs
+        self.grades = numpy.asarray(grades, dtype=numpy.float64)
+
+    @classmethod
+    def from_rows(cls, rows, grades):
+        # rows are (uniq, test, message, score, points_possible)
+        uniqs, tests, messages = {}, {}, {}
+        columns = ([], [], [], [], [])
+        for uniq, test, message, score, points_possible in rows:
+            columns[0].append(uniqs.setdefault(uniq, len(uniqs)))
+            columns[1].append(tests.setdefault(test, len(tests)))
+            columns[2].append(messages.setdefault(message, len(messages)))
+            columns[3].append(score)
+            columns[4].append(points_possible)
+        for uniq in grades:
+            uniqs.setdefault(uniq, len(uniqs))
+        return cls(list(uniqs), list(tests), list(messages), *columns,
+                [grades.get(uniq, numpy.nan) for uniq in uniqs])
+
+    @classmethod
+    def from_results(cls, results, grades):
+        return cls.from_rows(((uniq, str(test), r.message, r.score, r.points_possible)
+            for uniq, result in results.items() for test, r in result.items()), grades)
+
+    @classmethod
+    def from_dict(cls, data):
+        # data is a results.json dict, read without building TestCaseResults
+        return cls.from_rows(((uniq, test, r['message'], r['score'], r['points_possible'])
+            for uniq, entry in data.items()
+            for test, r in entry['test_case_results'].items()),
+            {uniq: entry['score'] for uniq, entry in data.items()})
+
+    @classmethod
+    def concat(cls, tables):
+        # e.g. several sections or terms; uniqs, tests and messages are merged
+        # by name, and a uniq appearing twice keeps its last grade
+        rows, grades = [], {}
+        for table in tables:
+            rows.extend(table.rows())
+            grades.update(zip(table.uniqs, table.grades))
+        return cls.from_rows(rows, grades)
+
+    def rows(self):
+        for u, t, m, score, points_possible in zip(self.uniq_idx, self.test_idx,
+                self.message_id, self.score, self.points_possible):
+            yield (self.uniqs[u], self.tests[t], self.messages[m], float(score),
+                    float(points_possible))
+
+    def to_dict(self):
+        # results.json form, less the additional text and timings the table
+        # doesn't keep
+        data = OrderedDict((uniq, {'score': float(grade), 'test_case_results': OrderedDict()})
+            for uniq, grade in zip(self.uniqs, self.grades))
+        for uniq, test, message, score, points_possible in self.rows():
+            data[uniq]['test_case_results'][test] = {
+                'message': message,
+                'score': score,
+                'points_possible': points_possible,
+            }
+        return data
+
+    def score_matrix(self):
+        # uniqs x tests, NaN where a submission has no result for a test
+        matrix = numpy.full((len(self.uniqs), len(self.tests)), numpy.nan)
+        matrix[self.uniq_idx, self.test_idx] = self.score
+        return matrix
+
+    def message_counts(self):
+        # {test: {message: count}}
+        counts = numpy.bincount(self.test_idx.astype(numpy.int64) * len(self.messages)
+                + self.message_id, minlength=len(self.tests) * len(self.messages))
+        counts = counts.reshape(len(self.tests), len(self.messages))
+        return {test: {self.messages[m]: int(counts[t, m]) for m in numpy.flatnonzero(counts[t])}
+            for t, test in enumerate(self.tests)}
+
+    def _per_test_mean(self, values, mask=None):
+        # mean of values per test over the rows in mask (all rows if None)
+        weights = numpy.ones(len(values)) if mask is None else mask.astype(numpy.float64)
+        total = numpy.bincount(self.test_idx, weights=values * weights, minlength=len(self.tests))
+        count = numpy.bincount(self.test_idx, weights=weights, minlength=len(self.tests))
+        return total / numpy.maximum(count, 1)
+
+    def pass_rates(self):
+        # fraction of results per test earning full points; results worth no
+        # points (the 'Clone' row, a 0-point gate like TestImports) would
+        # always pass, so they're left out, and a test with only those gets NaN
+        scored = self.points_possible > 0
+        rates = self._per_test_mean(self.score >= self.points_possible, scored)
+        rates[numpy.bincount(self.test_idx, weights=scored, minlength=len(self.tests)) == 0] = numpy.nan
+        return rates
+
+    def mean_scores(self):
+        return self._per_test_mean(self.score)
+
+    def discrimination(self):
+        # Correlation of each test's score with the rest of the grade (the
+        # total less that test), over submissions with a result for it. High
+        # is a test strong students pass and weak ones fail; near zero or
+        # negative is worth a look. NaN where a test's scores don't vary.
+        matrix = self.score_matrix()
+        present = ~numpy.isnan(matrix)
+        scores = numpy.where(present, matrix, 0.)
+        rest = scores.sum(axis=1)[:, None] - scores
+
+        n = numpy.maximum(present.sum(axis=0), 1)
+        d_score = numpy.where(present, scores - scores.sum(axis=0) / n, 0.)
+        d_rest = numpy.where(present, rest - (rest * present).sum(axis=0) / n, 0.)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return (d_score * d_rest).sum(axis=0) / numpy.sqrt(
+                    (d_score ** 2).sum(axis=0) * (d_rest ** 2).sum(axis=0))
+
+def repos(submission):
+    # A submission is a (url, path) tuple, or {name: (url, path)} for
+    # assignments spread over several repos
+    if isinstance(submission, dict):
+        return submission
+    return {None: submission}
+
+def workspace(submission):
+    # what TestRunner.test_submission expects: the path, or {name: path}
+    if isinstance(submission, dict):
+        return {name: repo[1] for name, repo in submission.items()}
+    return submission[1]
+
+def _grade_worker(test_runner, submission, clone_errors, conn):
+    # Own process group, so a timeout also takes out the student's processes.
+    # Commands have groups of their own, so those are killed on SIGTERM.
+    os.setpgrp()
+
+    def stop(signum, frame):
+        # no lock, the thread we interrupted may hold it
+        for pgid in list(_command_groups):
+            kill_group(pgid)
+        os._exit(1)
+    signal.signal(signal.SIGTERM, stop)
+    conn.send(test_runner.test_submission(submission, clone_errors))
+    conn.close()
+
 class Autograder:
     def __init__(self):
         self.results = ImmutableDict()
         self.grades = ImmutableDict()
+        # uniq (or (uniq, repo name)) -> (HEAD before, HEAD after) for
+        # everything we cloned or fetched
+        self.heads = {}
+        # uniq -> {repo name (None if only one): error} for failed clones
+        self.clone_errors = {}
+        # uniq -> seconds spent cloning or fetching, summed over its repos
+        self.clone_times = {}
+        self.results_log = None
+        self.reference = None
 
     def log(self, message, indent=0, color=None):
         for line in message.splitlines():
@@ -73,54 +874,435 @@ class Autograder:
     def set_submissions(self, submissions):
         self.submissions = submissions
 
-    def set_test_cases(self, test_cases):
+    def set_test_cases(self, test_cases, cache_dir=None, jobs=4):
         self.test_runner = TestRunner(
             test_cases,
-            lambda msg, indent=0, color=None: self.log(msg, indent=indent+2, color=color)
+            lambda msg, indent=0, color=None: self.log(msg, indent=indent+2, color=color),
+            ResultCache(cache_dir) if cache_dir else None,
+            jobs,
         )
 
-    def clone(self, rerun=False):
-        for uniq in list(self.submissions.keys()):
-            # don't use .items() because we're deleting things
-            submission = self.submissions[uniq]
+    def set_reference(self, path, starters=None):
+        # Borrow objects from a ReferenceMirror at path when cloning. starters
+        # maps repo name (None if only one) to the starter repo's url; repos
+        # without one are seeded from their first full-history clone.
+        self.reference = ReferenceMirror(path)
+        for name, url in (starters or {}).items():
+            self.log('Seeding reference mirror {} from {}'.format(path, url))
+            self.reference.add_starter(url, name)
+
+    def set_results_log(self, path, resume=False):
+        # Append each submission's results to path as soon as they're known.
+        # With resume, load what's already there and don't grade it again.
+        if resume and os.path.exists(path):
+            self.load_results(read_log(path))
+            for uniq in self.results:
+                self.submissions.pop(uniq, None)
+            self.log('Resuming, {} submissions already graded'.format(len(self.results)))
+            # cut off a torn last line, or the next entry would be glued to it
+            with open(path, 'rb+') as f:
+                f.truncate(f.read().rfind(b'\n') + 1)
+        self.results_log = open(path, 'a' if resume else 'w')
 
-            if os.path.isdir(submission[1]) and not rerun:
+    def log_result(self, uniq, result):
+        self.log_entry(uniq, result_entry(result, self.clone_times.get(uniq)))
+
+    def log_entry(self, uniq, entry):
+        if self.results_log is None:
+            return
+        line = OrderedDict(uniq=uniq)
+        line.update(entry)
+        self.results_log.write(json.dumps(line) + '\n')
+        self.results_log.flush()
+
+    def close_results_log(self):
+        if self.results_log is not None:
+            self.results_log.close()
+            self.results_log = None
+
+    def get_history(self, repo=None):
+        # the cheapest history that still covers every test case of the repo
+        return max([tc.history for tc in self.test_runner.test_cases if tc.repo == repo],
+                default=HISTORY_FULL)
+
+    def fetch_submission(self, uniq, submission, name=None):
+        # update an existing clone in place, returns False if it needs re-cloning
+        self.log('Fetching {} into {} for {}'.format(submission[0], submission[1], uniq))
+
+        old_head = head_sha(submission[1])
+        try:
+            sh.git('-C', submission[1], 'fetch', *FETCH_ARGS[self.get_history(name)],
+                    submission[0], 'HEAD')
+            sh.git('-C', submission[1], 'reset', '--hard', 'FETCH_HEAD')
+            sh.git('-C', submission[1], 'clean', '-ffdx')
+        except sh.ErrorReturnCode as e:
+            self.log(e.stderr.decode('utf-8'), color='red')
+            return False
+
+        new_head = head_sha(submission[1])
+        self.heads[uniq if name is None else (uniq, name)] = (old_head, new_head)
+        if old_head != new_head:
+            self.log('{} moved from {} to {}'.format(submission[1], old_head, new_head))
+        return True
+
+    def clone_submission(self, uniq, submission, rerun=False, fetch=False, name=None):
+        # Clone one repo of a submission, name says which for multi-repo ones.
+        # Returns the git error text on failure, None otherwise.
+        if os.path.isdir(submission[1]):
+            if fetch and self.fetch_submission(uniq, submission, name):
+                return None
+
+            if not rerun and not fetch:
                 self.log('{} exists, run with rerun=True to re-clone'.format(submission[1]))
-                continue
+                return None
+
+        self.log('Cloning {} into {} for {}'.format(submission[0], submission[1], uniq))
+
+        history = self.get_history(name)
+        args = list(CLONE_ARGS[history])
+        if self.reference:
+            args += self.reference.clone_args()
 
-            self.log('Cloning {} into {} for {}'.format(submission[0], submission[1], uniq))
+        sh.rm('-Rf', submission[1])
+        sh.mkdir('-p', submission[1])
+        try:
+            sh.git('clone', *args, submission[0], submission[1])
+        except sh.ErrorReturnCode as e:
+            err = e.stderr.decode('utf-8')
+            self.log(err, color='red')
 
+            # clean up
             sh.rm('-Rf', submission[1])
-            sh.mkdir('-p', submission[1])
+            return err
+
+        self.heads[uniq if name is None else (uniq, name)] = (None, head_sha(submission[1]))
+
+        # a shallow or blobless clone would make the mirror one too
+        if self.reference and history == HISTORY_FULL and head_sha(submission[1]):
             try:
-                sh.git('clone', submission[0], submission[1])
+                self.reference.absorb(submission[1], name)
             except sh.ErrorReturnCode as e:
-                err = e.stderr.decode('utf-8')
-                self.log(err, color='red')
-                self.results[uniq] = {
-                    'Clone': TestCaseResult('Failed', 0., 0., additional_text=err)
-                }
+                self.log(e.stderr.decode('utf-8'), color='red')
+        return None
+
+    def preflight(self, jobs=16, previous=None):
+        # check_access for every repo of every submission, in parallel. Returns
+        # {uniq: [check_access result plus 'repo' name]}, in submission order.
+        # Given a previous report, only submissions that failed (or weren't
+        # in it) are checked again and the rest carried over, so returns the
+        # uniqs checked this time too.
+        previous = previous or {}
+        checked = [uniq for uniq in self.submissions if uniq not in previous or
+            any(r['error'] for r in previous[uniq])]
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = OrderedDict(
+                (uniq, [(name, executor.submit(check_access, repo[0], self.get_history(name)))
+                    for name, repo in repos(self.submissions[uniq]).items()])
+                for uniq in checked
+            )
+
+        report = OrderedDict()
+        for uniq in self.submissions:
+            if uniq not in futures:
+                report[uniq] = previous[uniq]
+                continue
+            report[uniq] = [dict(future.result(), repo=name) for name, future in futures[uniq]]
+            for r in report[uniq]:
+                if r['error']:
+                    self.log('{}: cannot access {}'.format(uniq, r['url']), color='red')
+        return report, checked
+
+    def regrade(self, uniqs, test_cases, fetch=True):
+        # Rerun test_cases (names, or all if empty) for uniqs (all graded if
+        # empty) on top of already loaded results, cloning or fetching only
+        # the repos those test cases look at. Returns what changed as
+        # (uniq, test case, old result or None, new result) tuples.
+        selected = [tc for tc in self.test_runner.test_cases
+            if not test_cases or str(tc) in test_cases]
+        unknown = set(test_cases) - set(str(tc) for tc in selected)
+        if unknown:
+            raise LookupError('No test cases named {}'.format(', '.join(sorted(unknown))))
+        # their prerequisites decide whether they run, so rerun those too
+        wanted = set(selected)
+        while True:
+            more = set(p for tc in wanted for p in self.test_runner.prerequisites[tc]) - wanted
+            if not more:
+                break
+            wanted |= more
+        selected = [tc for tc in self.test_runner.test_cases if tc in wanted]
+        uniqs = list(uniqs) or list(self.results)
+        missing = [uniq for uniq in uniqs if uniq not in self.submissions]
+        if missing:
+            raise LookupError('Not in the submissions file: {}'.format(', '.join(missing)))
+
+        runner = TestRunner(selected, self.test_runner.log, jobs=self.test_runner.jobs)
+        if any(test_case.sandbox for test_case in selected):
+            sandbox.pool()
+        names = set(tc.repo for tc in selected)
+
+        changes = []
+        for uniq in uniqs:
+            submission = self.submissions[uniq]
+            if isinstance(submission, dict):
+                submission = OrderedDict((name, repo) for name, repo in submission.items()
+                    if name in names)
+
+            errs = OrderedDict()
+            seconds = 0.
+            for name, repo in repos(submission).items():
+                err, took = self.timed_clone_submission(uniq, repo, not fetch, fetch, name)
+                seconds += took
+                if err is not None:
+                    errs[name] = err
+            self.clone_times[uniq] = seconds
 
-                # clean up
-                sh.rm('-Rf', submission[1])
+            self.log('Regrading {}'.format(uniq))
+            if None in errs:
+                fresh = {str(tc): tc.result('Failed to clone', 0, additional_text=errs[None])
+                    for tc in selected}
+            else:
+                fresh = runner.test_submission(workspace(submission), errs)
 
-                # don't try and run test cases here, we failed
-                del self.submissions[uniq]
+            old = self.results.get(uniq, ImmutableDict())
+            merged = ImmutableDict()
+            for key, result in old.items():
+                # a whole-submission clone failure no longer applies
+                if key == 'Clone' and not errs:
+                    continue
+                merged[key] = fresh.get(key, result)
+            for key, result in fresh.items():
+                if key not in merged:
+                    merged[key] = result
 
-    def grade(self):
-        for key, submission in self.submissions.items():
-            self.log('Grading {}'.format(key))
-            self.results[key] = self.test_runner.test_submission(submission[1])
+            for key, result in fresh.items():
+                before = old.get(key)
+                if before is None or (before.score, before.message) != (result.score,
+                        result.message):
+                    changes.append((uniq, key, before, result))
+
+            if uniq in self.results:
+                self.results.replace(uniq, merged)
+            else:
+                self.results[uniq] = merged
+            grade = sum(r.score for r in merged.values())
+            if uniq in self.grades:
+                self.grades.replace(uniq, grade)
+            else:
+                self.grades[uniq] = grade
+
+        return changes
+
+    def timed_clone_submission(self, *args):
+        start = time.monotonic()
+        err = self.clone_submission(*args)
+        return err, time.monotonic() - start
+
+    def clone(self, rerun=False, jobs=1, fetch=False):
+        # clones are network bound, so threads are enough to overlap them,
+        # including the repos of a single multi-repo submission
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = OrderedDict(
+                (uniq, OrderedDict(
+                    (name, executor.submit(self.timed_clone_submission, uniq, repo, rerun,
+                        fetch, name))
+                    for name, repo in repos(submission).items()
+                ))
+                for uniq, submission in self.submissions.items()
+            )
+
+        # walk the futures in submission order so results stay deterministic
+        for uniq, repo_futures in futures.items():
+            timed = OrderedDict((name, future.result()) for name, future in repo_futures.items())
+            self.clone_times[uniq] = sum(seconds for _, seconds in timed.values())
+            errs = OrderedDict((name, err) for name, (err, _) in timed.items())
+            errs = OrderedDict((name, err) for name, err in errs.items() if err is not None)
+            if not errs:
+                continue
+
+            self.clone_errors[uniq] = errs
+            if len(errs) < len(repo_futures):
+                # test cases for the repos we did get still run
+                continue
+
+            if None in errs:
+                err = errs[None]
+            else:
+                err = '\n'.join('{}: {}'.format(name, e) for name, e in errs.items())
+            self.results[uniq] = {
+                'Clone': TestCaseResult('Failed', 0., 0., additional_text=err)
+            }
+            self.log_result(uniq, self.results[uniq])
+
+            # don't try and run test cases here, we failed
+            del self.submissions[uniq]
+
+    def grade_parallel(self, jobs, timeout=None):
+        # fork, so the test runner (and its logger) never has to be pickled;
+        # one process per submission so a crash or hang only costs that student
+        import multiprocessing
+        import multiprocessing.connection
+        ctx = multiprocessing.get_context('fork')
+        pending = list(self.submissions.items())
+        running = {}
+        results = {}
+
+        while pending or running:
+            while pending and len(running) < jobs:
+                uniq, submission = pending.pop(0)
+                self.log('Grading {}'.format(uniq))
+                recv_conn, send_conn = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=_grade_worker,
+                        args=(self.test_runner, workspace(submission),
+                            self.clone_errors.get(uniq), send_conn),
+                        daemon=True)
+                process.start()
+                send_conn.close()
+                running[uniq] = (process, recv_conn, time.monotonic())
+
+            ready = multiprocessing.connection.wait(
+                    [conn for _, conn, _ in running.values()], timeout=1)
+
+            for uniq, (process, conn, started) in list(running.items()):
+                if conn in ready:
+                    try:
+                        results[uniq] = conn.recv()
+                    except EOFError:
+                        process.join()
+                        err = 'Grading process exited with code {}'.format(process.exitcode)
+                        self.log('{}: {}'.format(uniq, err), color='red')
+                        results[uniq] = {
+                            'Grade': TestCaseResult('Failed', 0., 0., additional_text=err)
+                        }
+                elif timeout is not None and time.monotonic() - started > timeout:
+                    # a chance to kill its commands, then everything left
+                    try:
+                        os.killpg(process.pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+                    process.join(1)
+                    kill_group(process.pid)
+                    err = 'Grading took longer than {} seconds'.format(timeout)
+                    self.log('{}: {}'.format(uniq, err), color='red')
+                    results[uniq] = {
+                        'Grade': TestCaseResult('Timed out', 0., 0., additional_text=err)
+                    }
+                else:
+                    continue
+
+                process.join()
+                conn.close()
+                del running[uniq]
+                self.log_result(uniq, results[uniq])
+
+        return results
+
+    def check_jobs(self, jobs):
+        interactive = [str(tc) for tc in self.test_runner.test_cases if tc.interactive]
+        if jobs > 1 and interactive:
+            raise ValueError('{} may ask for input, so grade them with one job'.format(
+                ', '.join(interactive)))
+
+    def grade(self, jobs=1, timeout=None):
+        self.check_jobs(jobs)
+        if any(test_case.sandbox for test_case in self.test_runner.test_cases):
+            # before forking, so every grading process shares the one pool
+            sandbox.pool()
+
+        if jobs > 1:
+            results = self.grade_parallel(jobs, timeout)
+            # merge back in submission order, not completion order
+            for key in self.submissions:
+                self.results[key] = results[key]
+        else:
+            for key, submission in self.submissions.items():
+                self.log('Grading {}'.format(key))
+                self.results[key] = self.test_runner.test_submission(workspace(submission),
+                        self.clone_errors.get(key))
+                self.log_result(key, self.results[key])
 
         for key, results in self.results.items():
-            self.grades[key] = sum([r.score for _, r in results.items()])
+            if key not in self.grades:
+                self.grades[key] = sum([r.score for _, r in results.items()])
+
+        self.close_results_log()
+
+    def grade_queue(self, queue, poll=5., resume=False):
+        # Coordinate grading through a workqueue.WorkQueue: queue every
+        # submission, then collect results as workers on any machine push
+        # them, until every submission has one. Unless resuming, whatever an
+        # earlier run left in the queue is thrown away first.
+        dropped = queue.enqueue(self.submissions, resume)
+        if dropped:
+            self.log('Dropped {} jobs left in {} by an earlier run'.format(dropped, queue.path))
+        self.log('Queued {} submissions in {}, waiting for workers'.format(
+            len(self.submissions), queue.path))
+
+        entries = {}
+        while True:
+            for uniq in queue.abandoned():
+                err = 'No worker finished grading in {} attempts'.format(queue.max_attempts)
+                self.log('{}: {}'.format(uniq, err), color='red')
+                queue.complete(uniq, result_entry({
+                    'Grade': TestCaseResult('Failed', 0., 0., additional_text=err)
+                }))
+
+            waiting = set(self.submissions) - set(entries)
+            for uniq, entry in queue.results(waiting).items():
+                self.log('{} graded [{}]'.format(uniq, entry['score']))
+                self.log_entry(uniq, entry)
+                entries[uniq] = entry
+
+            if len(entries) == len(self.submissions):
+                break
+            time.sleep(poll)
+
+        # merged in submission order, like grade
+        self.load_results((uniq, entries[uniq]) for uniq in self.submissions)
+        self.close_results_log()
+
+    def work(self, queue, worker, lease=300., rerun=False, fetch=False, poll=5.):
+        # Pull submissions from a workqueue.WorkQueue, clone and grade them
+        # and push the results back, until the queue is finished. The lease
+        # is renewed while grading, so only a dead worker loses its job.
+        if any(test_case.sandbox for test_case in self.test_runner.test_cases):
+            sandbox.pool()
+
+        while True:
+            job = queue.lease(worker, lease)
+            if job is None:
+                if queue.finished():
+                    return
+                time.sleep(poll)
+                continue
+
+            seq, uniq, submission = job
+            self.log('Grading {} as {}'.format(uniq, worker))
+            # a job can come back to us if our lease on it ran out
+            self.results.pop(uniq, None)
+            self.clone_errors.pop(uniq, None)
+            self.submissions = OrderedDict([(uniq, submission)])
+
+            with queue.heartbeat(uniq, worker, lease):
+                self.clone(rerun=rerun, fetch=fetch)
+                if uniq in self.submissions:
+                    self.results[uniq] = self.test_runner.test_submission(
+                            workspace(submission), self.clone_errors.get(uniq))
+            queue.complete(uniq, result_entry(self.results[uniq], self.clone_times.get(uniq)),
+                    seq)
 
     def get_results(self):
         return self.results
 
     def load_results(self, data):
-        for uniq, result in data.items():
+        # data is a results.json dict, or (uniq, result) pairs from read_log
+        items = data.items() if hasattr(data, 'items') else data
+        for uniq, result in items:
             self.grades[uniq] = result['score']
+            if 'clone_seconds' in result:
+                self.clone_times[uniq] = result['clone_seconds']
             self.results[uniq] = ImmutableDict()
             for testcase, testcase_result in result['test_case_results'].items():
                 self.results[uniq][testcase] = TestCaseResult(**testcase_result)
@@ -128,10 +1310,8 @@ class Autograder:
     def to_dict(self):
         uniq_to_result = ImmutableDict()
         for uniq, result in self.results.items():
-            uniq_to_result[uniq] = {
-                'score': self.grades[uniq],
-                'test_case_results': {k: v.__dict__ for k, v in result.items()}
-            }
+            uniq_to_result[uniq] = result_entry(result, self.clone_times.get(uniq))
+            uniq_to_result[uniq]['score'] = self.grades[uniq]
 
         return uniq_to_result
 
@@ -141,26 +1321,76 @@ class Autograder:
     def get_grades(self):
         return self.grades
 
-    def print_stats(self):
+    def table(self):
+        return ResultTable.from_results(self.results, self.grades)
+
+    def print_stats(self, bins=10):
         pp = pprint.PrettyPrinter()
+        table = self.table()
 
         # Results
-        r_counter = defaultdict(Counter)
-        for result in self.results.values():
-            for test, result in result.items():
-                r_counter[str(test)][str(result)] += 1
+        pp.pprint(table.message_counts())
 
-        pp.pprint(r_counter)
+        # Per test case
+        pass_rates = table.pass_rates()
+        means = table.mean_scores()
+        discrimination = table.discrimination()
+        pp.pprint({test: {
+            'pass_rate': round(float(pass_rates[t]), 3),
+            'mean': round(float(means[t]), 3),
+            'discrimination': round(float(discrimination[t]), 3),
+        } for t, test in enumerate(table.tests)})
 
         # Grades
-        grades_arr = list(self.grades.values())
+        grades_arr = table.grades[~numpy.isnan(table.grades)]
+        if len(grades_arr) == 0:
+            return
+        percentiles = numpy.percentile(grades_arr, [10, 25, 50, 75, 90])
         stats = {
-            'min': numpy.min(grades_arr),
-            'max': numpy.max(grades_arr),
-            'mean': numpy.mean(grades_arr),
-            'median': numpy.median(grades_arr),
-            'stdev': numpy.std(grades_arr),
+            'min': float(numpy.min(grades_arr)),
+            'max': float(numpy.max(grades_arr)),
+            'mean': float(numpy.mean(grades_arr)),
+            'median': float(numpy.median(grades_arr)),
+            'stdev': float(numpy.std(grades_arr)),
             'n': len(grades_arr),
+            'percentiles': dict(zip(('p10', 'p25', 'p50', 'p75', 'p90'),
+                (float(p) for p in percentiles))),
         }
 
         pp.pprint(stats)
+
+        # Grade histogram, as (low, high, count) buckets
+        counts, edges = numpy.histogram(grades_arr, bins=bins)
+        pp.pprint([(float(lo), float(hi), int(n))
+            for lo, hi, n in zip(edges[:-1], edges[1:], counts)])
+
+        self.print_timing_stats()
+
+    def print_timing_stats(self, slowest=10):
+        pp = pprint.PrettyPrinter()
+
+        # Per test case latency, for results that have timings
+        walls = defaultdict(list)
+        totals = {}
+        for uniq, result in self.results.items():
+            total = self.clone_times.get(uniq, 0.)
+            for test, r in result.items():
+                if r.timing:
+                    walls[str(test)].append(r.timing['wall'])
+                    total += r.timing['wall']
+            totals[uniq] = total
+
+        if not walls and not self.clone_times:
+            return
+
+        def percentiles(times):
+            p50, p95 = numpy.percentile(times, [50, 95])
+            return {'p50': float(p50), 'p95': float(p95), 'max': float(numpy.max(times))}
+
+        latency = {test: percentiles(times) for test, times in walls.items()}
+        if self.clone_times:
+            latency['Clone'] = percentiles(list(self.clone_times.values()))
+        pp.pprint(latency)
+
+        # Slowest submissions, clone plus all test cases
+        pp.pprint(sorted(totals.items(), key=lambda item: item[1], reverse=True)[:slowest])
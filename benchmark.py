@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Runs clone -> grade -> write_results -> write_emails -> print_stats end to
+# end against a synthetic cohort of local bare repos, so changes to the
+# pipeline can be timed on any box without network access.
+
+import click
+import contextlib
+import importlib.util
+import json
+import os
+import random
+import resource
+import sh
+import tempfile
+import time
+from termcolor import cprint
+
+import autograder
+import emails
+
+RPN_VARIANTS = {
+    'good': '''\
+def calculate(arg):
+    stack = []
+    for token in arg.split():
+        if token == '^':
+            b, a = stack.pop(), stack.pop()
+            stack.append(a ** b)
+        else:
+            stack.append(int(token))
+    return stack.pop()
+''',
+    'bad': '''\
+def calculate(arg):
+    stack = []
+    for token in arg.split():
+        if token == '^':
+            b, a = stack.pop(), stack.pop()
+            stack.append(a * b)
+        else:
+            stack.append(int(token))
+    return stack.pop()
+''',
+    'pathological': '''\
+def calculate(arg):
+    while True:
+        pass
+''',
+}
+
+TEST_RPN = '''\
+import unittest
+import rpn
+
+class TestBasics(unittest.TestCase):
+    def test_exponentiation(self):
+        self.assertEqual(rpn.calculate("2 3 ^"), 8)
+'''
+
+STARTER_FILES = {
+    'rpn.py': None,
+    'test_rpn.py': TEST_RPN,
+    '.travis.yml': 'language: python\nscript: python3 -m unittest\n',
+    '.bashrc': 'alias ll="ls -l"\n',
+    'ssh/config': 'Host *\n  ServerAliveInterval 60\n',
+    '.vimrc': 'set number\n',
+}
+
+def fast_import_stream(rng, variant, files, file_size, commits):
+    # A git fast-import stream for one student's history: the starter files,
+    # then `commits` commits each rewriting one of `files` filler files
+    out = []
+    mark = 0
+    when = 1500000000
+
+    def data(payload):
+        payload = payload.encode('utf-8')
+        out.append(b'data ' + str(len(payload)).encode() + b'\n' + payload + b'\n')
+
+    def blob(content):
+        nonlocal mark
+        mark += 1
+        out.append(b'blob\nmark :' + str(mark).encode() + b'\n')
+        data(content)
+        return mark
+
+    starter = dict(STARTER_FILES, **{'rpn.py': RPN_VARIANTS[variant]})
+    changes = [(path, blob(content)) for path, content in starter.items()]
+    parent = None
+    for i in range(commits + 1):
+        if i > 0:
+            path = 'data/file{}.txt'.format(rng.randrange(max(files, 1)))
+            changes = [(path, blob(''.join(rng.choice('abcdef \n')
+                for _ in range(file_size))))]
+        mark += 1
+        out.append('commit refs/heads/master\nmark :{}\n'.format(mark).encode())
+        for who in ('author', 'committer'):
+            out.append('{} Student <student@example.com> {} +0000\n'.format(
+                who, when + i * 60).encode())
+        data('Commit number {} of the synthetic history\n'.format(i))
+        if parent is not None:
+            out.append('from :{}\n'.format(parent).encode())
+        for path, blob_mark in changes:
+            out.append('M 100644 :{} {}\n'.format(blob_mark, path).encode())
+        parent = mark
+
+    return b''.join(out)
+
+def make_cohort(root, students, files, file_size, commits, mix, seed):
+    rng = random.Random(seed)
+    variants = [v for v, weight in mix.items() for _ in range(weight)]
+
+    submissions = {}
+    for n in range(students):
+        uniq = 'student{:04d}'.format(n)
+        remote = os.path.join(root, 'remotes', uniq + '.git')
+        sh.git('init', '-q', '--bare', remote)
+        sh.git('-C', remote, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+        sh.git('-C', remote, 'fast-import', '--quiet',
+                _in=fast_import_stream(rng, rng.choice(variants), files, file_size, commits))
+        submissions[uniq] = ('file://' + remote, os.path.join(root, 'clones', uniq))
+
+    return submissions
+
+def load_test_cases(assignment):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), assignment, 'test_cases.py')
+    spec = importlib.util.spec_from_file_location('test_cases', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    if assignment == 'dotfiles':
+        return [module.ShellConfigFile(), module.SshConfigFile(), module.AnyOtherConfigFile()]
+    # as unit-testing/grade.py grades, less TestTravis: it may prompt, so it
+    # can't be graded in parallel, and it only parses a YAML file
+    return [module.TestImports(), module.TestExponentiationGood(),
+            module.TestExponentiationBad(), module.TestExponentiationImpl()]
+
+def peak_rss():
+    # kilobytes, for us and for the largest child we've waited on
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+@click.command()
+@click.option('--students', '-n', default=50, show_default=True)
+@click.option('--files', default=20, show_default=True, help="Filler files per repo")
+@click.option('--file-size', default=4096, show_default=True, help="Bytes per filler file")
+@click.option('--commits', default=10, show_default=True, help="Commits per repo")
+@click.option('--mix', default='good:8,bad:2,pathological:1', show_default=True,
+        help="Relative weights of the rpn.py variants")
+@click.option('--assignment', default='unit-testing', show_default=True,
+        type=click.Choice(['unit-testing', 'dotfiles']))
+@click.option('--clone-jobs', default=8, show_default=True)
+@click.option('--jobs', '-j', default=os.cpu_count(), show_default=True)
+@click.option('--timeout', default=5., show_default=True,
+        help="Test case timeout, so pathological submissions stay cheap")
+@click.option('--seed', default=0, show_default=True)
+@click.option('--workdir', default=None, help="Keep the cohort here instead of a temp dir")
+@click.option('--output', '-o', default=None, help="Also write the report as JSON")
+def benchmark(students, files, file_size, commits, mix, assignment, clone_jobs, jobs, timeout,
+        seed, workdir, output):
+    '''Time the grading pipeline against a synthetic cohort'''
+    mix = {k: int(v) for k, v in (part.split(':') for part in mix.split(','))}
+    root = workdir or tempfile.mkdtemp(prefix='csprag-bench-')
+    cprint('Generating {} students in {}...'.format(students, root), 'green')
+    submissions = make_cohort(root, students, files, file_size, commits, mix, seed)
+
+    test_cases = load_test_cases(assignment)
+    for test_case in test_cases:
+        test_case.timeout = timeout
+
+    ag = autograder.Autograder()
+    ag.log = lambda *args, **kwargs: None
+    ag.set_test_cases(test_cases)
+    ag.set_submissions(submissions)
+    ag.set_results_log(os.path.join(root, 'results.jsonl'))
+
+    phases = [
+        ('clone', lambda: ag.clone(rerun=True, jobs=clone_jobs)),
+        ('grade', lambda: ag.grade(jobs=jobs)),
+        ('write_results', lambda: open(os.path.join(root, 'results.json'), 'w').write(
+            ag.to_json())),
+        ('write_emails', lambda: emails.write_emails(ag.to_dict(), 'Benchmark', 4., 'never',
+            'https://example.com', os.path.join(root, 'emails'), lambda x: x)),
+        ('print_stats', ag.print_stats),
+    ]
+
+    report = {'students': students, 'phases': {}}
+    for name, phase in phases:
+        start = time.monotonic()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            phase()
+        elapsed = time.monotonic() - start
+        rss_self, rss_children = peak_rss()
+        report['phases'][name] = {
+            'seconds': elapsed,
+            'submissions_per_second': students / elapsed if elapsed else None,
+            'peak_rss_kb': rss_self,
+            'peak_child_rss_kb': rss_children,
+        }
+
+    report['total_seconds'] = sum(p['seconds'] for p in report['phases'].values())
+
+    cprint('{:<14} {:>10} {:>12} {:>14} {:>14}'.format(
+        'phase', 'seconds', 'subs/sec', 'peak rss KB', 'child rss KB'), 'green')
+    for name, p in report['phases'].items():
+        print('{:<14} {:>10.3f} {:>12.1f} {:>14} {:>14}'.format(name, p['seconds'],
+            p['submissions_per_second'] or 0., p['peak_rss_kb'], p['peak_child_rss_kb']))
+    print('{:<14} {:>10.3f} {:>12.1f}'.format('total', report['total_seconds'],
+        students / report['total_seconds']))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    benchmark()
@@ -7,42 +7,234 @@ import os
 import autograder
 from termcolor import cprint
 
-import emails
-
 def init(cli):
     cli.add_command(grade)
+    cli.add_command(work)
+    cli.add_command(regrade)
+    cli.add_command(preflight)
     cli.add_command(write_results)
     cli.add_command(write_canvas)
     cli.add_command(load_results)
     cli.add_command(write_emails)
     cli.add_command(send_emails)
     cli.add_command(print_stats)
+    cli.add_command(refresh_reference)
+    cli.add_command(gc_reference)
 
 @click.command()
 @click.option('--submissions', '-s', required=True, help="Submissions file location")
 @click.option('--rerun', '-r', is_flag=True, default=False)
+@click.option('--fetch', is_flag=True, default=False,
+        help="Update existing clones in place with git fetch instead of re-cloning")
+@click.option('--clone-jobs', default=1, show_default=True, type=click.IntRange(min=1),
+        help="Number of repositories to clone concurrently")
+@click.option('--jobs', '-j', default=1, show_default=True, type=click.IntRange(min=1),
+        help="Number of submissions to grade in parallel processes")
+@click.option('--submission-timeout', default=None, type=float,
+        help="Seconds before a parallel grading process is killed")
+@click.option('--cache-dir', default=None,
+        help="Reuse results for unchanged submissions and test cases from this directory")
+@click.option('--test-jobs', default=4, show_default=True, type=click.IntRange(min=1),
+        help="Number of a submission's read-only test cases to run at once")
+@click.option('--log', 'log_file', default='results.jsonl', show_default=True,
+        help="Append each submission's results here as soon as it is graded")
+@click.option('--resume', is_flag=True, default=False,
+        help="Skip submissions already in the results log, and with --queue keep the "
+        "queue's jobs instead of starting it over")
+@click.option('--reference', default=None,
+        help="Local mirror of the starter repo for clones to borrow objects from")
+@click.option('--starter', multiple=True,
+        help="Starter repo url to seed --reference with, as [repo name=]url")
+@click.option('--queue', default=None,
+        help="Queue submissions in this SQLite file for `work` processes to grade, "
+        "and collect their results")
 @click.pass_obj
-def grade(obj, submissions, rerun):
+def grade(obj, submissions, rerun, fetch, clone_jobs, jobs, submission_timeout, cache_dir,
+        test_jobs, log_file, resume, reference, starter, queue):
     '''Run the autograder'''
     cprint('Grading...', 'green')
 
     test_cases, submissions = obj['get_test_cases_and_submissions'](submissions)
 
-    obj['ag'].set_test_cases(test_cases)
+    if cache_dir:
+        cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    obj['ag'].set_test_cases(test_cases, cache_dir=cache_dir, jobs=test_jobs)
+    try:
+        obj['ag'].check_jobs(jobs)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--jobs')
     obj['ag'].set_submissions(submissions)
+    obj['ag'].set_results_log(os.path.abspath(os.path.expanduser(log_file)), resume)
+    if reference:
+        starters = dict((None, url) if '=' not in url else tuple(url.split('=', 1))
+            for url in starter)
+        obj['ag'].set_reference(os.path.abspath(os.path.expanduser(reference)), starters)
+
+    if queue:
+        import workqueue
+        obj['ag'].grade_queue(workqueue.WorkQueue(os.path.abspath(os.path.expanduser(queue))),
+                resume=resume)
+        return
+
+    obj['ag'].clone(rerun, jobs=clone_jobs, fetch=fetch)
+    obj['ag'].grade(jobs=jobs, timeout=submission_timeout)
+
+@click.command()
+@click.option('--submissions', '-s', required=True,
+        help="Submissions file location, for the test cases; jobs come from the queue")
+@click.option('--queue', required=True, help="SQLite queue file given to `grade --queue`")
+@click.option('--worker', default=None, help="Name for this worker, default host:pid")
+@click.option('--lease', default=300., show_default=True, type=float,
+        help="Seconds without a heartbeat before our job goes to another worker")
+@click.option('--rerun', '-r', is_flag=True, default=False)
+@click.option('--fetch', is_flag=True, default=False,
+        help="Update existing clones in place with git fetch instead of re-cloning")
+@click.option('--cache-dir', default=None,
+        help="Reuse results for unchanged submissions and test cases from this directory")
+@click.option('--test-jobs', default=4, show_default=True, type=click.IntRange(min=1),
+        help="Number of a submission's read-only test cases to run at once")
+@click.pass_obj
+def work(obj, submissions, queue, worker, lease, rerun, fetch, cache_dir, test_jobs):
+    '''Grade submissions from a queue until it is finished'''
+    import socket
+    import workqueue
+
+    test_cases, _ = obj['get_test_cases_and_submissions'](submissions)
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    cprint('Working on {} as {}...'.format(queue, worker), 'green')
+
+    if cache_dir:
+        cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    obj['ag'].set_test_cases(test_cases, cache_dir=cache_dir, jobs=test_jobs)
+    obj['ag'].work(workqueue.WorkQueue(os.path.abspath(os.path.expanduser(queue))), worker,
+            lease=lease, rerun=rerun, fetch=fetch)
+
+@click.command()
+@click.option('--submissions', '-s', required=True, help="Submissions file location")
+@click.option('--uniq', '-u', multiple=True, help="Uniqname to regrade, default everyone")
+@click.option('--test', '-t', 'test_names', multiple=True,
+        help="Test case to rerun, default all of them")
+@click.option('--file', '-f', default='results.json', show_default=True,
+        help="Results to regrade on top of")
+@click.option('--output', '-o', default=None, help="Where to write the results, default --file")
+@click.option('--diff', default='regrade.csv', show_default=True,
+        help="Where to write the changed scores")
+@click.option('--reclone', is_flag=True, default=False,
+        help="Clone the repos again instead of fetching into the existing clones")
+@click.pass_obj
+def regrade(obj, submissions, uniq, test_names, file, output, diff, reclone):
+    '''Rerun some test cases for some students on top of existing results'''
+    test_cases, submissions = obj['get_test_cases_and_submissions'](submissions)
+    file = os.path.abspath(os.path.expanduser(file))
+    output = os.path.abspath(os.path.expanduser(output)) if output else file
+    diff = os.path.abspath(os.path.expanduser(diff))
+
+    ag = obj['ag']
+    ag.set_test_cases(test_cases)
+    ag.set_submissions(submissions)
+    with open(file) as f:
+        ag.load_results(json.load(f))
+
+    cprint('Regrading {} for {}...'.format(', '.join(test_names) or 'all test cases',
+        ', '.join(uniq) or 'everyone'), 'green')
+    try:
+        changes = ag.regrade(uniq, test_names, fetch=not reclone)
+    except LookupError as e:
+        raise click.BadParameter(str(e))
+
+    with open(diff, 'w') as csvf:
+        writer = csv.DictWriter(csvf, fieldnames=['uniq', 'test_case', 'old_score', 'new_score',
+            'old_message', 'new_message'])
+        writer.writeheader()
+        for uniq, test, before, after in changes:
+            writer.writerow({
+                'uniq': uniq,
+                'test_case': test,
+                'old_score': before.score if before else '',
+                'new_score': after.score,
+                'old_message': before.message if before else '',
+                'new_message': after.message,
+            })
+            cprint('{} {}: {} -> {}'.format(uniq, test, before.score if before else None,
+                after.score), 'yellow')
+    cprint('{} results changed, written to {}'.format(len(changes), diff), 'green')
 
-    obj['ag'].clone(rerun)
-    obj['ag'].grade()
+    cprint('Writing {}...'.format(output), 'green')
+    with open(output, 'w') as outfile:
+        outfile.write(ag.to_json())
+
+@click.command()
+@click.option('--submissions', '-s', required=True, help="Submissions file location")
+@click.option('--jobs', '-j', default=16, show_default=True, type=click.IntRange(min=1),
+        help="Number of repositories to check concurrently")
+@click.option('--report', default='preflight.json', show_default=True,
+        help="Results of the check, kept so the next run only rechecks failures")
+@click.option('--all', 'recheck_all', is_flag=True, default=False,
+        help="Check everyone, not only those who failed last time")
+@click.option('--dest', '-d', default=None,
+        help="Write emails to the students checked, to a directory or .zip")
+@click.option('--assignment-name', '-n', default='this assignment', show_default=True)
+@click.pass_obj
+def preflight(obj, submissions, jobs, report, recheck_all, dest, assignment_name):
+    '''Check the autograder can access every repo, without cloning'''
+    test_cases, submissions = obj['get_test_cases_and_submissions'](submissions)
+    report = os.path.abspath(os.path.expanduser(report))
+
+    previous = None
+    if os.path.exists(report) and not recheck_all:
+        with open(report) as f:
+            previous = json.load(f)
+
+    ag = obj['ag']
+    ag.set_test_cases(test_cases)
+    ag.set_submissions(submissions)
+    results, checked = ag.preflight(jobs=jobs, previous=previous)
+
+    failing = [uniq for uniq, repos in results.items() if any(r['error'] for r in repos)]
+    cprint('Checked {} submissions, {} cannot be accessed'.format(len(checked), len(failing)),
+            'red' if failing else 'green')
+
+    with open(report, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if dest:
+        import emails
+        dest = os.path.abspath(os.path.expanduser(dest))
+        cprint('Writing {} emails to {}...'.format(len(checked), dest), 'green')
+        min_commits = obj['get_preflight_min_commits']() if 'get_preflight_min_commits' in obj \
+                else None
+        emails.write_preflight_emails(results, checked, assignment_name, dest, min_commits)
+
+@click.command()
+@click.option('--reference', required=True, help="Reference mirror directory")
+def refresh_reference(reference):
+    '''Fetch new starter commits into the reference mirror'''
+    mirror = autograder.ReferenceMirror(os.path.abspath(os.path.expanduser(reference)))
+    cprint('Refreshing {}...'.format(mirror.path), 'green')
+    mirror.refresh()
+    print(mirror.usage())
+
+@click.command()
+@click.option('--reference', required=True, help="Reference mirror directory")
+def gc_reference(reference):
+    '''Garbage collect the reference mirror (not while cloning)'''
+    mirror = autograder.ReferenceMirror(os.path.abspath(os.path.expanduser(reference)))
+    cprint('Collecting garbage in {}...'.format(mirror.path), 'green')
+    mirror.gc()
+    print(mirror.usage())
 
 @click.command()
 @click.option('--file', '-f', default='results.json', show_default=True)
 @click.pass_obj
 def load_results(obj, file):
-    '''Load JSON results from the autograder'''
+    '''Load JSON (or JSON Lines log) results from the autograder'''
     file = os.path.abspath(os.path.expanduser(file))
     cprint('Loading {}...'.format(file), 'green')
 
-    obj['ag'].load_results(json.loads(open(file).read()))
+    if file.endswith('.jsonl'):
+        obj['ag'].load_results(autograder.read_log(file))
+    else:
+        obj['ag'].load_results(json.loads(open(file).read()))
 
 @click.command()
 @click.option('--file', '-f', default='results.json', show_default=True)
@@ -70,13 +262,19 @@ def write_canvas(obj, outfile):
     cprint('Writing {} scores to {}...'.format(
         len(obj['ag'].get_grades()), os.path.abspath(outfile)), 'green')
 
+    # assignments that upload final grades rather than raw scores say how
+    if 'canvas_func' in obj:
+        canvas_func = obj['canvas_func']
+    else:
+        canvas_func = lambda x: x
+
     with open(outfile, 'w') as csvf:
         writer = csv.DictWriter(csvf, fieldnames=['Email', 'Total Score'])
         writer.writeheader()
         for uniq, score in obj['ag'].get_grades().items():
             writer.writerow({
                 'Email': uniq,
-                'Total Score': score,
+                'Total Score': canvas_func(score),
             })
 
 @click.command()
@@ -85,8 +283,9 @@ def write_canvas(obj, outfile):
 @click.option('--total-points', '-t', required=True)
 @click.option('--regrade-date', '-r', required=True)
 @click.option('--autograder-link', '-l', required=True)
-@click.option('--dest', '-d', required=True)
-def write_emails(obj, assignment_name, total_points, regrade_date, autograder_link, dest):
+@click.option('--dest', '-d', required=True, help="Directory, or a .zip to write one archive")
+@click.option('--jobs', '-j', default=8, show_default=True, type=click.IntRange(min=1))
+def write_emails(obj, assignment_name, total_points, regrade_date, autograder_link, dest, jobs):
     '''Generate autograder emails but do not send'''
     dest = os.path.abspath(os.path.expanduser(dest))
     total_points = float(total_points)
@@ -98,23 +297,33 @@ def write_emails(obj, assignment_name, total_points, regrade_date, autograder_li
     else:
         ceil_func = lambda x: x
 
+    import emails
     emails.write_emails(obj['ag'].to_dict(), assignment_name, total_points,
-            regrade_date, autograder_link, dest, ceil_func)
+            regrade_date, autograder_link, dest, ceil_func, jobs=jobs)
 
 @click.command()
 @click.pass_obj
-@click.option('--loc', '-l', required=True)
+@click.option('--loc', '-l', required=True, help="Directory or .zip from write_emails")
 @click.option('--subject', '-s', required=True)
 @click.option('--cc', '-c', default='')
 @click.option('--smtp-host', '-h', default='smtp.mail.umich.edu', show_default=True)
 @click.option('--smtp-username', '-u', required=True, help="Just your uniqname for smtp.mail.umich.edu")
 @click.option('--smtp-password', '-p', prompt='SMTP password', hide_input=True)
-def send_emails(obj, loc, subject, cc, smtp_host, smtp_username, smtp_password):
+@click.option('--rate', default=50, show_default=True, type=click.IntRange(min=1),
+        help="Messages allowed per --window")
+@click.option('--window', default=300., show_default=True, type=float,
+        help="Rate limit window in seconds")
+@click.option('--dry-run', is_flag=True, default=False,
+        help="Go through the motions against a local stand-in, sending nothing")
+def send_emails(obj, loc, subject, cc, smtp_host, smtp_username, smtp_password, rate, window,
+        dry_run):
     '''Send pre-generated autograder emails'''
     cc = cc.split()
+    loc = os.path.abspath(os.path.expanduser(loc))
 
+    import emails
     emails.send_emails(loc, subject, cc, {
         'host': smtp_host,
         'user': smtp_username,
         'pass': smtp_password,
-    })
+    }, messages=rate, window=window, dry_run=dry_run)
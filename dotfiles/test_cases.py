@@ -1,54 +1,96 @@
 import autograder
 
 import os
-import sh
 import yaml
 
-from fuzzywuzzy import process
-
-class FuzzyRecursiveFileFinder(autograder.TestCase):
-    def test(self, repo_path):
-        with sh.pushd(repo_path):
-            seen_files = set()
-            # account for nested dirs
-            for root, dirs, files in os.walk('.'):
-                if '.git' in dirs:
-                    dirs.remove('.git') # ignore git
-
-                if not files:
-                    continue
-
-                for f in files[:]: # slice so we don't screw up iteration by removing
-                    if os.path.islink(os.path.join(root, f)):
+from fuzzywuzzy import fuzz, utils
+
+class FileIndex:
+    # Every non-empty, non-symlink file in a repo, grouped by directory in
+    # os.walk order, with names already run through fuzzywuzzy's processor.
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.dirs = []
+        self._scan('.')
+
+    def _scan(self, root):
+        files, dirs = [], []
+        try:
+            with os.scandir(os.path.join(self.repo_path, root)) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        if entry.name != '.git': # ignore git
+                            dirs.append(entry)
+                    elif entry.is_symlink():
                         # symlinks not supported
-                        files.remove(f)
                         continue
-                    if not os.path.getsize(os.path.join(root, f)) > 0:
+                    elif entry.stat().st_size > 0:
                         # prune empty files
-                        files.remove(f)
-                        continue
-
-                if not files: # check again after we pruned
-                    continue
+                        files.append(os.path.join(root, entry.name).strip('./'))
+        except OSError:
+            return
+
+        if files:
+            self.dirs.append((files, [utils.full_process(f, force_ascii=True) for f in files]))
+
+        # account for nested dirs, but like os.walk don't follow symlinks
+        for d in dirs:
+            if not d.is_symlink():
+                self._scan(os.path.join(root, d.name))
+
+    def files(self):
+        return [f for files, _ in self.dirs for f in files]
+
+    def first_match(self, patterns, threshold=90):
+        # Index of the first pattern scoring above threshold against any file,
+        # checking directory by directory, same as process.extractOne per
+        # (directory, pattern) but processing every string only once.
+        queries = [utils.full_process(p, force_ascii=True) for p in patterns]
+        for _, processed in self.dirs:
+            for i, query in enumerate(queries):
+                if any(fuzz.WRatio(query, f, full_process=False) > threshold
+                        for f in self.candidates(query, processed, threshold)):
+                    return i
+        return None
+
+    @staticmethod
+    def candidates(query, processed, threshold):
+        # WRatio can't score above 90 when one string is at least 1.5 times as
+        # long as the other: its plain ratio is then at most 80 and the partial
+        # ones are scaled by 0.9. Most files in a big tree are ruled out that
+        # way, without running the matcher on them.
+        if threshold < 90:
+            return processed
+        return [f for f in processed
+            if 2 * max(len(query), len(f)) < 3 * min(len(query), len(f))]
 
-                files = [os.path.join(root, f).strip('./') for f in files]
-
-                seen_files.update(files)
-
-                for vf, points, msg in self.valid_files:
-                    closest_match, match_score = process.extractOne(vf, files)
-                    if match_score > 90:
-                        # good enough
-                        return self.result(msg, points)
+class FuzzyRecursiveFileFinder(autograder.TestCase):
+    history = autograder.HISTORY_HEAD
+    read_only = True
 
-            if len(seen_files) == 0:
-                additional_text = "No non-empty, non-symlink files"
-            else:
-                additional_text = 'Non-empty, non-symlink files:\n'
-                additional_text += '\n'.join([ '\t{}'.format(f) for f in seen_files])
+    # shared by every FuzzyRecursiveFileFinder, so the repo is walked once
+    @autograder.fixture
+    def file_index(self, repo_path):
+        return FileIndex(repo_path)
 
-            return self.result('No {} configuration file found'.format(self.ftype), 0,
-                    additional_text=additional_text)
+    def test(self, repo_path):
+        index = self.file_index(repo_path)
+
+        match = index.first_match([vf for vf, _, _ in self.valid_files])
+        if match is not None:
+            # good enough
+            _, points, msg = self.valid_files[match]
+            return self.result(msg, points)
+
+        seen_files = index.files()
+        if len(seen_files) == 0:
+            additional_text = "No non-empty, non-symlink files"
+        else:
+            additional_text = 'Non-empty, non-symlink files:\n'
+            additional_text += '\n'.join([ '\t{}'.format(f) for f in seen_files])
+
+        return self.result('No {} configuration file found'.format(self.ftype), 0,
+                additional_text=additional_text)
 
 class ShellConfigFile(FuzzyRecursiveFileFinder):
     points_possible = 1.5
@@ -1,35 +1,176 @@
 #!/usr/bin/env python3
 
-from jinja2 import Environment, FileSystemLoader
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
 import os
-import sh
 from termcolor import cprint
 import time
+import zipfile
 
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 
-def write_emails(data, assignment_name, total_points, regrade_date, autograder_link, dest, ceil_func):
-    env = Environment(loader=FileSystemLoader(os.path.dirname(__file__) + '/email_templates'))
-    template = env.get_template('c4cs.html')
-    sh.mkdir('-p', dest)
-    with sh.pushd(dest):
-        for uniq, submission in data.items():
-            with open(uniq, 'w') as f:
-                f.write(template.render(
-                    uniq=uniq,
-                    assignment_name=assignment_name,
-                    total_possible=total_points,
-                    regrade_date=regrade_date,
-                    autograder_link=autograder_link,
-                    raw_score=submission['score'],
-                    final_score=ceil_func(submission['score']),
-                    testcases=submission['test_case_results'],
-                ))
-
-def send_email(uniqname, body, SUBJECT, CC):
+@functools.lru_cache()
+def environment():
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+    # compiled templates are cached on disk, so later runs skip compiling too
+    return Environment(
+        loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            'email_templates')),
+        bytecode_cache=FileSystemBytecodeCache(),
+    )
+
+def write_emails(data, assignment_name, total_points, regrade_date, autograder_link, dest,
+        ceil_func, jobs=8):
+    # Writes one file per uniq into the dest directory, or into a zip archive
+    # if dest ends in .zip. Test case blocks are rendered once per distinct
+    # result, since most students share most of them.
+    template = environment().get_template('c4cs.html')
+    testcase_template = environment().get_template('c4cs_testcase.html')
+
+    def key(name, result):
+        return (name, result['message'], result['score'], result['points_possible'],
+                result['additional_text'])
+
+    fragments = {}
+    for submission in data.values():
+        for name, result in submission['test_case_results'].items():
+            fragments.setdefault(key(name, result), (name, result))
+
+    def render_fragment(item):
+        name, result = item
+        return testcase_template.render(name=name, result=result)
+
+    def render(item):
+        uniq, submission = item
+        return uniq, template.render(
+            uniq=uniq,
+            assignment_name=assignment_name,
+            total_possible=total_points,
+            regrade_date=regrade_date,
+            autograder_link=autograder_link,
+            raw_score=submission['score'],
+            final_score=ceil_func(submission['score']),
+            testcases=[fragments[key(name, result)]
+                for name, result in submission['test_case_results'].items()],
+        )
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        keys = list(fragments)
+        for k, fragment in zip(keys, executor.map(render_fragment, [fragments[k] for k in keys])):
+            fragments[k] = fragment
+
+        save_emails(executor, executor.map(render, data.items()), dest)
+
+def save_emails(executor, rendered, dest):
+    # rendered is (uniq, body) pairs, saved as read_emails expects them
+    def write(item):
+        uniq, body = item
+        with open(os.path.join(dest, uniq), 'w') as f:
+            f.write(body)
+
+    if dest.endswith('.zip'):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for uniq, body in rendered:
+                archive.writestr(uniq, body)
+    else:
+        os.makedirs(dest, exist_ok=True)
+        list(executor.map(write, rendered))
+
+def write_preflight_emails(report, uniqs, assignment_name, dest, min_commits=None, jobs=8):
+    # Tell each of uniqs what the autograder can see of their repos, from an
+    # Autograder.preflight report. min_commits maps repo name (None if only
+    # one) to how many commits a real history should have at least.
+    template = environment().get_template('preflight.html')
+    min_commits = min_commits or {}
+
+    def render(uniq):
+        return uniq, template.render(
+            uniq=uniq,
+            assignment_name=assignment_name,
+            repos=[dict(r, min_commits=min_commits.get(r['repo'])) for r in report[uniq]],
+        )
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        save_emails(executor, executor.map(render, uniqs), dest)
+
+class TokenBucket:
+    # Allows bursts of up to `messages`, refilling at messages/window per second
+    def __init__(self, messages, window):
+        self.capacity = float(messages)
+        self.rate = messages / float(window)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def take(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+class DryRunSMTP:
+    # Local stand-in for smtplib.SMTP_SSL that accepts and discards everything
+    def __init__(self, host=None):
+        self.host = host
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        return {}
+
+    def quit(self):
+        pass
+
+class Mailer:
+    # An SMTP connection that reconnects and retries when the server drops us
+    def __init__(self, smtp, connect=smtplib.SMTP_SSL, retries=5):
+        self.smtp = smtp
+        self.connect = connect
+        self.retries = retries
+        self.sm = None
+
+    def _connect(self):
+        sm = self.connect(host=self.smtp['host'])
+        sm.login(self.smtp['user'], self.smtp['pass'])
+        self.sm = sm
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        for attempt in range(self.retries + 1):
+            try:
+                if self.sm is None:
+                    self._connect()
+                return self.sm.sendmail(from_addr, to_addrs, msg)
+            except OSError as e:
+                # every SMTPException is an OSError too, but only these mean we
+                # lost the connection; a refused recipient or a bad password
+                # won't get any better by reconnecting
+                if isinstance(e, smtplib.SMTPException) and not isinstance(e,
+                        (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+                    raise
+                self.sm = None
+                if attempt == self.retries:
+                    raise
+                cprint('SMTP connection lost ({}), reconnecting'.format(e), 'red')
+                time.sleep(2 ** attempt)
+
+    def quit(self):
+        if self.sm is not None:
+            try:
+                self.sm.quit()
+            except smtplib.SMTPException:
+                pass
+            self.sm = None
+
+def send_email(mailer, uniqname, body, SUBJECT, CC):
     FROM = 'csprag-admin@umich.edu'
     TO = uniqname + '@umich.edu'
     REPLY_TO_ADDRESS = 'csprag-admin@umich.edu'
@@ -45,24 +186,61 @@ def send_email(uniqname, body, SUBJECT, CC):
     msg.attach(MIMEText(body, encoding))
     msg.add_header('reply-to', REPLY_TO_ADDRESS)
 
-    global sm
-
     send_to = [TO,] + CC
-    sm.sendmail(FROM, send_to, msg.as_string())
-
-def send_emails(loc, subject, cc, smtp):
-    global sm
-    sm = smtplib.SMTP_SSL(host=smtp['host'])
-    sm.login(smtp['user'], smtp['pass'])
-
-    with sh.pushd(loc):
-        num_sent = 0;
-        for uniq in os.listdir():
-            with open(uniq) as f:
-                send_email(uniq, f.read(), subject, cc)
-                num_sent += 1
-                # Be kind to the smtp server
-                if num_sent % 50 == 0:
-                    time.sleep(300)
-                else:
-                    time.sleep(1)
+    mailer.sendmail(FROM, send_to, msg.as_string())
+
+def read_emails(loc):
+    # {uniq: body} for a directory of emails or a .zip written by write_emails
+    if loc.endswith('.zip'):
+        with zipfile.ZipFile(loc) as archive:
+            return {uniq: archive.read(uniq).decode('utf-8') for uniq in archive.namelist()}
+
+    emails = {}
+    for uniq in os.listdir(loc):
+        if uniq.startswith('.'):
+            continue
+        with open(os.path.join(loc, uniq)) as f:
+            emails[uniq] = f.read()
+    return emails
+
+def send_emails(loc, subject, cc, smtp, messages=50, window=300, dry_run=False):
+    # Send every email in loc, at most `messages` per `window` seconds. Each
+    # sent email is recorded (uniq and a hash of its body) in a .sent log next
+    # to the emails, so rerunning after an interruption picks up where it
+    # stopped instead of emailing people twice, while a rewritten email (say a
+    # later preflight into the same dest) still goes out.
+    mailer = Mailer(smtp, connect=DryRunSMTP if dry_run else smtplib.SMTP_SSL)
+    bucket = TokenBucket(messages, window)
+    # a dry run keeps its own log so it never suppresses the real send
+    suffix = '.sent-dry-run' if dry_run else '.sent'
+    sent_log = loc + suffix if loc.endswith('.zip') else os.path.join(loc, suffix)
+
+    sent = set()
+    if os.path.exists(sent_log):
+        with open(sent_log) as f:
+            sent = set(line.strip() for line in f)
+
+    emails = read_emails(loc)
+
+    def entry(uniq):
+        return '{} {}'.format(uniq, hashlib.sha1(emails[uniq].encode('utf-8')).hexdigest())
+
+    pending = sorted(uniq for uniq in emails if entry(uniq) not in sent)
+    cprint('{} already sent, {} to send'.format(len(emails) - len(pending), len(pending)), 'green')
+
+    try:
+        with open(sent_log, 'a') as log:
+            for uniq in pending:
+                # Be kind to the smtp server; a dry run has none to be kind to
+                if not dry_run:
+                    bucket.take()
+                try:
+                    send_email(mailer, uniq, emails[uniq], subject, cc)
+                except smtplib.SMTPRecipientsRefused as e:
+                    cprint('Recipient refused for {}: {}'.format(uniq, e), 'red')
+                    continue
+                log.write(entry(uniq) + '\n')
+                log.flush()
+                os.fsync(log.fileno())
+    finally:
+        mailer.quit()
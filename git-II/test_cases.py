@@ -0,0 +1,244 @@
+import autograder
+import sandbox
+
+import git # pip install gitpython
+import numpy
+import os
+import sh
+
+from fuzzywuzzy import fuzz
+
+def commit_history(repo_path, rev):
+    # Per-commit columns for everything reachable from rev, newest first,
+    # from a single `git log --numstat` rather than a `git diff` per commit.
+    # lines is insertions + deletions against the first parent, like
+    # GitPython's commit.stats.total['lines'] (binary files count as 0).
+    out = git.Repo(repo_path).git.log(rev, '--no-renames', '--numstat',
+            '--format=%x1e%H%x1f%P%x1f%B%x1f')
+
+    columns = {k: [] for k in ('hexsha', 'parents', 'summary', 'summary_len', 'multi_line',
+        'non_blank_second', 'giant_body', 'lines')}
+    for record in out.split('\x1e')[1:]:
+        hexsha, parents, message, numstat = record.split('\x1f', 3)
+        lines = message.strip().split('\n')
+
+        changed = 0
+        for stat in numstat.splitlines():
+            if not stat.strip():
+                continue
+            insertions, deletions, _ = stat.split('\t', 2)
+            if insertions != '-':
+                changed += int(insertions) + int(deletions)
+
+        columns['hexsha'].append(hexsha)
+        columns['parents'].append(len(parents.split()))
+        columns['summary'].append(lines[0])
+        columns['summary_len'].append(len(lines[0]))
+        columns['multi_line'].append(len(lines) > 1)
+        columns['non_blank_second'].append(len(lines) > 1 and lines[1].strip() != '')
+        # long lines in the body, ignoring quoted stuff
+        columns['giant_body'].append(any(len(line) > 80 and not
+            (line[0:2] == '  ' or line[0] == '>') for line in lines[2:]))
+        columns['lines'].append(changed)
+
+    return {k: numpy.array(v) for k, v in columns.items()}
+
+class CommitHistory(autograder.TestCase):
+    points_possible = 2.0
+    repo = 'q1'
+    history = autograder.HISTORY_FULL
+    read_only = True
+
+    TOTAL_COMMITS_THRESHOLD = 5
+    TINY_SUMMARY_THRESHOLD = 12
+    LONG_SUMMARY_THRESHOLD = 72
+    MINI_LINES_THRESHOLD = 4
+    MANY_LINES_THRESHOLD = 50
+
+    def test(self, repo_path):
+        try:
+            history = commit_history(repo_path, 'master')
+        except git.exc.GitCommandError:
+            history = None
+        if history is None or len(history['hexsha']) == 0:
+            return self.result('No master branch or no commits on master branch', 0)
+
+        # Skip merge commits
+        commits = {k: v[history['parents'] <= 1] for k, v in history.items()}
+        non_merge_count = len(commits['hexsha'])
+
+        if non_merge_count < self.TOTAL_COMMITS_THRESHOLD:
+            return self.result('There is not enough history here to have realistically used '
+                    'git effectively (only {} non-merge commit{})'.format(
+                        non_merge_count, '' if non_merge_count==1 else 's'), 0)
+
+        # Commit message quality
+        tiny_summary_line_count = numpy.count_nonzero(
+                commits['summary_len'] < self.TINY_SUMMARY_THRESHOLD)
+        long_summary_line_count = numpy.count_nonzero(
+                commits['summary_len'] > self.LONG_SUMMARY_THRESHOLD)
+        non_single_line_count = numpy.count_nonzero(commits['multi_line'])
+        giant_body_lines = numpy.count_nonzero(commits['multi_line'] & commits['giant_body'])
+        non_blank = commits['hexsha'][commits['multi_line'] & commits['non_blank_second']]
+        non_blank_second_lines = non_blank[-1] if len(non_blank) else None
+
+        # Commit content quality, ignoring the most recent commit
+        lines_changed = commits['lines'][1:]
+        mini_lines_changed = numpy.count_nonzero(lines_changed < self.MINI_LINES_THRESHOLD)
+        many_lines_changed = numpy.count_nonzero(lines_changed > self.MANY_LINES_THRESHOLD)
+
+        text = []
+        grade = 0
+
+        # Base points for using git at all: 0.2
+        text.append('Used git [base 0.2]')
+        grade += 0.2
+
+        # Summary quality: 0.6
+        text.append('Summary Quality [base 0.6]')
+        grade += 0.6
+        # -- No more than 25% tiny: 0.3
+        if tiny_summary_line_count / non_merge_count > 0.25:
+            text.append('  [-0.3]: Too many tiny summaries')
+            grade -= 0.3
+        # -- No more than 10% huge: 0.3
+        if long_summary_line_count / non_merge_count > 0.10:
+            text.append('  [-0.3]: Too many huge summaries')
+            grade -= 0.3
+
+        # Multi-line (explained) commits: 0.6
+        text.append('Complex commits [base 0.6]')
+        grade += 0.6
+        #    0-none
+        if non_single_line_count == 0:
+            text.append('  [-0.6] All single line commits')
+            grade -= 0.6
+        #   Minus Commit Body Style
+        else:
+            # Base Score:
+            # 0.4-any, 0.6-enough
+            if non_single_line_count / non_merge_count < 0.1:
+                text.append('  [-0.2] Too few detailed commits')
+                text.append('    While short, single-line commit messages are good enough '
+                        'for most commits, sometimes the changes really do require a little '
+                        'more explanation. It is a good idea to get in the habit of jotting '
+                        'down even just an extra line or two as a quick note.')
+                grade -= 0.2
+
+            #   -- Non-blank second lines: -0.2
+            if non_blank_second_lines is not None:
+                text.append('  [-0.2] Commits ({}) with non-blank second lines'.format(
+                    non_blank_second_lines))
+                grade -= 0.2
+
+            #   -- Giant lines in commit body: -0.2
+            if giant_body_lines > 0:
+                text.append('  [-0.2] Commits with long lines (> 80 charcter) in body')
+                grade -= 0.2
+
+        # Commit content: 0.6
+        text.append('Commit size [base 0.6]')
+        grade += 0.6
+        # -- No more than 25% tiny: 0.3
+        if mini_lines_changed / non_merge_count > 0.25:
+            text.append('  [-0.3]: Too many tiny commits.')
+            grade -= 0.3
+        # -- No more than 25% huge: 0.3
+        if many_lines_changed / non_merge_count > 0.25:
+            text.append('  [-0.3]: Too many giant commits.')
+            grade -= 0.3
+
+        return self.result('Used git for an EECS project', grade,
+                additional_text='\n'.join(text))
+
+class MergeContentConflict(autograder.TestCase):
+    points_possible = 1.0
+    repo = 'q2a'
+    history = autograder.HISTORY_HEAD
+    sandbox = True
+
+    golden = '''\
+Welcome to the simple test program
+
+According to current estimates, the diag construction will be done:
+Summer 2017.
+'''
+    test_golden = '''\
+Success
+'''
+
+    def test(self, repo_path):
+        main_path = os.path.join(repo_path, 'main.py')
+        test_path = os.path.join(repo_path, 'test.sh')
+
+        if not os.path.exists(main_path):
+            return self.result('No main.py in repository', 0)
+        if not os.path.exists(test_path):
+            return self.result('No test.sh in repository', 0)
+
+        mainpy = open(main_path).read()
+        testsh = open(test_path).read()
+        if ('>>>>' in mainpy) or ('<<<<' in mainpy):
+            return self.result('Unresolved conflict in main.py', 0,
+                    additional_text=mainpy)
+        if ('>>>>' in testsh) or ('<<<<' in testsh):
+            return self.result('Unresolved conflict in test.sh', 0,
+                    additional_text=testsh)
+
+        try:
+            out = self.probe(repo_path, script='main.py')['stdout']
+        except sandbox.ProbeError as e:
+            return self.result('main.py or test.sh does not run', 0,
+                    additional_text='Ran main.py\n\n{}'.format(e))
+        try:
+            test_out = str(self.command('bash')('test.sh', _cwd=repo_path))
+        except sh.ErrorReturnCode as e:
+            return self.result('main.py or test.sh does not run', 0,
+                    additional_text='Ran {}\n\nStdout\n{}Stderr\n{}'.format(
+                        e.full_cmd, e.stdout.decode('utf8'), e.stderr.decode('utf8')))
+
+        if ('diag construction' not in out) or ('Summer 2017' not in out):
+            return self.result('main.py content not merged, missing diag construction or '
+                    'completion date', 0, additional_text='Output of main.py:\n' + out)
+
+        text = []
+        grade = 1.0
+
+        # fuzz is a fuzzy string matching library that should
+        # allow for modest formatting or text differences
+        if fuzz.ratio(out, self.golden) < 75:
+            text.append('Output of main.py seems to be a merge, but not quite correct [-0.4]. '
+                    'Expected:\n{}\nstudent main.py output:\n{}'.format(self.golden, out))
+            grade -= 0.4
+
+        if fuzz.ratio(test_out, self.test_golden) < 75:
+            text.append('test.sh does not report success [-0.4]. Output of test.sh:\n{}'.format(
+                test_out))
+            grade -= 0.4
+
+        if grade == 1.0:
+            return self.result('All correct!', grade)
+        return self.result('Merge content conflict partly resolved', grade,
+                additional_text='\n'.join(text))
+
+class MergePathConflict(autograder.TestCase):
+    points_possible = 1.0
+    repo = 'q2b'
+    history = autograder.HISTORY_HEAD
+    read_only = True
+
+    golden = '''\
+README.md
+main.py
+sales-2016-03-01
+sales-2016-03-02
+sales-2016-03-03
+'''
+
+    def test(self, repo_path):
+        out = str(sh.ls('-1', _cwd=repo_path))
+
+        if out == self.golden:
+            return self.result('All correct!', 1)
+        return self.result('Incorrect files in directory after merge', 0,
+                additional_text='Expected:\n{}\nbut got:\n{}'.format(self.golden, out))
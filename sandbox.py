@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# A pool of warm Python interpreters for running submission code.
+#
+# One zygote process is forked from the autograder with the usual stdlib
+# already imported. Each job connects to it over a unix socket, and the
+# zygote forks a fresh child for the job: the child moves into the repo,
+# applies the test case's rlimits, imports whatever the job asks for (so
+# student modules never outlive the job) and sends back a structured
+# result. Forking a warm interpreter is much cheaper than starting python3.
+
+import atexit
+import contextlib
+import importlib
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import resource
+import runpy
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+# imported once in the zygote, so jobs don't pay for them
+PRELOAD = ['collections', 'inspect', 'json', 're', 'traceback', 'unittest']
+
+class SandboxError(Exception):
+    pass
+
+class Timeout(SandboxError):
+    pass
+
+class CPULimit(SandboxError):
+    pass
+
+class ProbeError(SandboxError):
+    # the probe raised, or the job's process died; str() is the traceback
+    pass
+
+def _run_job(conn, job):
+    # in the forked child
+    os.setpgrp()
+    conn.send(('pid', os.getpid()))
+
+    def on_xcpu(signum, frame):
+        conn.send(('cpu', None))
+        os._exit(1)
+    signal.signal(signal.SIGXCPU, on_xcpu)
+
+    limits = job['limits']
+    resource.setrlimit(resource.RLIMIT_CPU, (limits['cpu'], limits['cpu'] + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (limits['memory'], limits['memory']))
+    resource.setrlimit(resource.RLIMIT_NPROC, (limits['nproc'], limits['nproc']))
+
+    # nothing a submission does should wait on our terminal
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+
+    os.chdir(job['path'])
+    sys.path.insert(0, job['path'])
+    importlib.invalidate_caches()
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            if job['script'] is not None:
+                sys.argv = [job['script']]
+                try:
+                    runpy.run_path(job['script'], run_name='__main__')
+                except SystemExit as e:
+                    if e.code not in (None, 0):
+                        raise
+                value = None
+            else:
+                namespace = {'__name__': '__probe__'}
+                exec(compile(job['source'], '<probe>', 'exec'), namespace)
+                value = namespace[job['func']](*job['args'])
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        conn.send(('result', {
+            'value': value,
+            'stdout': stdout.getvalue(),
+            'stderr': stderr.getvalue(),
+            'rusage': {'cpu': usage.ru_utime + usage.ru_stime, 'max_rss': usage.ru_maxrss},
+        }))
+    except BaseException:
+        conn.send(('error', 'Stdout\n{}Stderr\n{}{}'.format(stdout.getvalue(),
+            stderr.getvalue(), traceback.format_exc())))
+
+def _serve(listener, preload):
+    for name in preload:
+        importlib.import_module(name)
+    # children are never waited on
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    while True:
+        conn = listener.accept()
+        if os.fork() == 0:
+            status = 0
+            try:
+                # Undo what only the zygote should have: with SIGCHLD ignored,
+                # the job's own subprocesses would be reaped before it could
+                # see their exit codes, and with the listening socket it
+                # could take other submissions' jobs. Listener.close() would
+                # also unlink the socket the zygote still serves on.
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                listener._listener._socket.close()
+                _run_job(conn, conn.recv())
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        conn.close()
+
+class Pool:
+    def __init__(self, preload=PRELOAD):
+        self.authkey = os.urandom(16)
+        self.dir = tempfile.mkdtemp(prefix='autograder-sandbox-')
+        self.listener = multiprocessing.connection.Listener(
+                os.path.join(self.dir, 'socket'), 'AF_UNIX', authkey=self.authkey)
+        self.zygote = multiprocessing.get_context('fork').Process(target=_serve,
+                args=(self.listener, preload), daemon=True)
+        self.zygote.start()
+
+    def run(self, path, source=None, func='probe', args=(), script=None, timeout=60,
+            cpu=30, memory=2 * 1024**3, nproc=1024):
+        # Either exec source and call func(*args) from it, or run the script
+        # file as __main__, in a child working in path with path on sys.path.
+        # Returns {'value', 'stdout', 'stderr', 'rusage'}; value must pickle.
+        deadline = time.monotonic() + timeout
+        conn = multiprocessing.connection.Client(self.listener.address, 'AF_UNIX',
+                authkey=self.authkey)
+        try:
+            conn.send({
+                'path': os.path.abspath(path),
+                'source': source,
+                'func': func,
+                'args': tuple(args),
+                'script': script,
+                'limits': {'cpu': cpu, 'memory': memory, 'nproc': nproc},
+            })
+            pid = None
+            while True:
+                if not conn.poll(max(deadline - time.monotonic(), 0)):
+                    if pid is not None:
+                        with contextlib.suppress(ProcessLookupError):
+                            os.killpg(pid, signal.SIGKILL)
+                    raise Timeout('Ran longer than {} seconds'.format(timeout))
+                try:
+                    kind, payload = conn.recv()
+                except EOFError:
+                    raise ProbeError('Probe process died')
+                if kind == 'pid':
+                    pid = payload
+                elif kind == 'cpu':
+                    raise CPULimit('Used more than {} seconds of CPU time'.format(cpu))
+                elif kind == 'error':
+                    raise ProbeError(payload)
+                else:
+                    return payload
+        finally:
+            conn.close()
+
+    def close(self):
+        self.zygote.terminate()
+        self.zygote.join()
+        self.listener.close()
+        os.rmdir(self.dir)
+
+_pool = None
+
+def pool():
+    # The shared pool, started on first use. Start it before forking grading
+    # processes so they all share one zygote.
+    global _pool
+    if _pool is None:
+        _pool = Pool()
+        atexit.register(_pool.close)
+    return _pool
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Times the quick grade.py invocations we script during regrade week and
+# fails if any is over budget, or if it imports a module that only grading
+# or emailing should need.
+
+import click
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from termcolor import cprint
+
+ASSIGNMENTS = ['dotfiles', 'git-II', 'unit-testing']
+
+# none of these should load for commands that neither grade nor email
+HEAVY = ['fuzzywuzzy', 'git', 'jinja2', 'numpy', 'sh', 'yaml']
+
+def invocations(results, canvas):
+    # (name, grade.py arguments, seconds allowed, whether HEAVY modules are
+    # off limits); print_stats needs numpy, so it gets longer
+    return [
+        ('--help', ['--help'], 0.25, True),
+        ('send_emails --help', ['send-emails', '--help'], 0.25, True),
+        ('load_results write_canvas', ['load-results', '-f', results,
+            'write-canvas', '-o', canvas], 0.25, True),
+        ('load_results print_stats', ['load-results', '-f', results, 'print-stats'], 0.5, False),
+    ]
+
+def write_results(path):
+    data = {
+        'student{:04d}'.format(n): {
+            'score': float(n % 4),
+            'test_case_results': {
+                'Test{}'.format(t): {
+                    'message': 'Passed' if (n + t) % 3 else 'Failed',
+                    'score': float((n + t) % 3 != 0),
+                    'points_possible': 1.,
+                    'additional_text': None,
+                } for t in range(4)
+            },
+        } for n in range(200)
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def run(assignment_dir, args):
+    # seconds, and the top-level names of every module imported
+    start = time.monotonic()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', 'grade.py'] + args,
+            cwd=assignment_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True)
+    elapsed = time.monotonic() - start
+    if proc.returncode != 0:
+        raise click.ClickException('grade.py {} failed in {}:\n{}'.format(
+            ' '.join(args), assignment_dir, proc.stderr))
+
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip().split('.')[0])
+    return elapsed, modules
+
+@click.command()
+@click.option('--runs', default=5, show_default=True, type=click.IntRange(min=1))
+@click.option('--budget-scale', default=1., show_default=True,
+        help="Multiply every invocation's budget, for slower machines")
+@click.option('--assignment', '-a', multiple=True, type=click.Choice(ASSIGNMENTS),
+        help="Assignments to check, default all")
+def benchmark(runs, budget_scale, assignment):
+    '''Check grade.py startup stays within budget'''
+    root = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='csprag-startup-') as tmp:
+        results = os.path.join(tmp, 'results.json')
+        write_results(results)
+
+        cprint('{:<14} {:<28} {:>10}'.format('assignment', 'invocation', 'seconds'), 'green')
+        for name in assignment or ASSIGNMENTS:
+            for label, args, budget, light in invocations(results, os.path.join(tmp, 'scores.csv')):
+                times = []
+                for _ in range(runs):
+                    elapsed, modules = run(os.path.join(root, name), args)
+                    times.append(elapsed)
+                median = statistics.median(times)
+                budget *= budget_scale
+                print('{:<14} {:<28} {:>10.3f}'.format(name, label, median))
+
+                if median > budget:
+                    failures.append('{} {}: {:.3f}s is over the {:.3f}s budget'.format(
+                        name, label, median, budget))
+                heavy = sorted(modules.intersection(HEAVY)) if light else []
+                if heavy:
+                    failures.append('{} {}: imported {}'.format(name, label, ', '.join(heavy)))
+
+    for failure in failures:
+        cprint(failure, 'red')
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    benchmark()
@@ -7,10 +7,9 @@ import sys
 
 sys.path.append('..')
 
+import autograder
 import cli
 
-from test_cases import *
-
 def score_to_final(score):
     if score > 2.:
         return 4.
@@ -19,6 +18,10 @@ def score_to_final(score):
     return 0.
 
 def get_test_cases_and_submissions(submissionsf):
+    # imported here, so commands that never grade skip the test cases' imports
+    from test_cases import (TestTravis, TestImports, TestExponentiationGood,
+            TestExponentiationBad, TestExponentiationImpl)
+
     uniq_to_repo = {}
 
     def gen_submissions():
@@ -33,6 +36,7 @@ def get_test_cases_and_submissions(submissionsf):
 
     test_cases = [
         TestTravis(),
+        TestImports(),
         TestExponentiationGood(),
         TestExponentiationBad(),
         TestExponentiationImpl(),
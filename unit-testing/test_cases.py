@@ -1,11 +1,15 @@
 import autograder
+import sandbox
 
 import os
-import sh
 import yaml
 
 class TestTravis(autograder.TestCase):
     points_possible = 1.0
+    history = autograder.HISTORY_HEAD
+    read_only = True
+    # asks whether to give credit for scripts it doesn't recognize
+    interactive = True
 
     valid_test_scripts = [
         'test_rpn.py',
@@ -30,125 +34,172 @@ class TestTravis(autograder.TestCase):
     ]
 
     def test(self, repo_path):
-        with sh.pushd(repo_path):
-            if not os.path.exists('.travis.yml'):
-                return self.result('No .travis.yml file', 0)
-            try:
-                travis = yaml.load(open('.travis.yml'))
-
-                for script in self.valid_test_scripts:
-                    if script in travis['script']:
-                        return self.result('Travis set up to run tests', 1)
-
-                print(travis['script'])
-                allow = input("Give credit? [y/N] ").strip().upper()
-                if len(allow) and allow[0] == 'Y':
+        travis_path = os.path.join(repo_path, '.travis.yml')
+        if not os.path.exists(travis_path):
+            return self.result('No .travis.yml file', 0)
+        try:
+            travis = yaml.load(open(travis_path))
+
+            for script in self.valid_test_scripts:
+                if script in travis['script']:
                     return self.result('Travis set up to run tests', 1)
-                else:
-                    return self.result('Travis does not appear to run tests', 0)
-            except Exception as exc:
-                return self.result('Failed to parse .travis.yml as valid YAML',
-                                   0, additional_text=str(exc))
+        except Exception as exc:
+            return self.result('Failed to parse .travis.yml as valid YAML',
+                               0, additional_text=str(exc))
+
+        # outside the try, so a failed prompt isn't blamed on the student
+        print(travis['script'])
+        allow = input("Give credit? [y/N] ").strip().upper()
+        if len(allow) and allow[0] == 'Y':
+            return self.result('Travis set up to run tests', 1)
+        else:
+            return self.result('Travis does not appear to run tests', 0)
 
 # Test exponentiation ourselves, then monkey patch to break calculate
-# function and verify that exponentiation test works
-# golden lines should be
-# ['>>> 8', '>>> None', '>>> -1', '>>> GoodFail']
-ugly_one_liner = '''
+# function and verify that exponentiation test works. Each step is
+# {'value': str(returned)} or {'error': traceback}; the student test steps
+# are None when there's no exponentiation test, and patched_test is
+# {'failed': True} when the test caught the broken calculate.
+exponentiation_probe = '''
 import inspect
 import traceback
 import rpn
 import test_rpn
-c = rpn.calculate
-T = test_rpn.TestBasics()
-fns = inspect.getmembers(T, predicate=lambda x: inspect.ismethod(x) and 'test_' in x.__name__ and 'test_add' not in x.__name__ and 'test_subtract' not in x.__name__ and 'test_sub' not in x.__name__ and 'test_toomany' not in x.__name__ and 'test_multiplication' not in x.__name__ and 'test_multiply' not in x.__name__ and 'test_divide' not in x.__name__ and 'test_badstring' not in x.__name__)
+
 test_exp_names = ['test_pow','test_exponent1', 'test_exponential', 'test_carat',
 'test_exp', 'test_exponent', 'test_power3', 'test_exponentiation', 'test_power',
 'test_expo', 'test_exponentiate', 'test_exponant', 'test_carrot', 'test_exponentiationPos',
 'test_exponentiationZ', 'test_exponentiationNeg']
-
-if len(fns) > 1:
-    for f in fns:
-        if f[0] in test_exp_names:
-            test_fn = f[1]
-            break
-    else:
-        print(fns)
-        assert(len(fns) == 1)
-elif len(fns) == 0:
-    test_fn = None
-else:
-    test_fn = fns[0][1]
-try:
-    print(">>> {}".format(rpn.calculate("2 3 ^")))
-except Exception as e:
-    print(">>> Fail our ^ test. " + traceback.format_exc().replace("\\n", "ç"))
-try:
-    if test_fn:
-        print(">>> {}".format(test_fn()))
+other_names = ['test_add', 'test_subtract', 'test_sub', 'test_toomany', 'test_multiplication',
+'test_multiply', 'test_divide', 'test_badstring']
+
+def step(func):
+    try:
+        return {'value': str(func())}
+    except Exception:
+        return {'error': traceback.format_exc()}
+
+def probe():
+    c = rpn.calculate
+    T = test_rpn.TestBasics()
+    fns = inspect.getmembers(T, predicate=lambda x: inspect.ismethod(x) and
+            'test_' in x.__name__ and not any(name in x.__name__ for name in other_names))
+
+    if len(fns) > 1:
+        for f in fns:
+            if f[0] in test_exp_names:
+                test_fn = f[1]
+                break
+        else:
+            raise AssertionError('Could not pick an exponentiation test from {}'.format(
+                [name for name, _ in fns]))
+    elif len(fns) == 0:
+        test_fn = None
     else:
-        print(">>> !! NO TEST FN")
-except Exception as e:
-    print(">>> Fail to pass student ^ test function. " + traceback.format_exc().replace("\\n", "ç"))
-test_rpn.rpn.calculate = lambda x: -1 if "^" in x else c(x)
-try:
-    print(">>> {}".format(rpn.calculate("2 3 ^")))
-except Exception as e:
-    print(">>> Fail ^ after monkey patch. " + traceback.format_exc().replace("\\n", "ç"))
-try:
+        test_fn = fns[0][1]
+
+    result = {
+        'calculate': step(lambda: rpn.calculate("2 3 ^")),
+        'test': test_fn and step(test_fn),
+    }
+
+    test_rpn.rpn.calculate = lambda x: -1 if "^" in x else c(x)
     if test_fn:
-        print(">>> {}".format(test_fn()))
+        try:
+            result['patched_test'] = {'value': str(test_fn())}
+        except T.failureException:
+            result['patched_test'] = {'failed': True}
+        except Exception:
+            result['patched_test'] = {'error': traceback.format_exc()}
     else:
-        print(">>> !! NO TEST FN")
-except T.failureException:
-    print(">>> GoodFail")
-except Exception as e:
-    print(">>> Fail ^ (bad) test function threw an unknown exception. " + traceback.format_exc().replace("\\n", "ç"))
+        result['patched_test'] = None
+    return result
 '''
 
+imports_probe = '''
+import rpn
+import test_rpn
+
+def probe():
+    pass
+'''
+
+class TestImports(autograder.TestCase):
+    # Worth nothing itself, but the exponentiation tests can't pass if rpn.py
+    # or test_rpn.py doesn't import, so they're skipped instead of each
+    # reporting the same traceback
+    points_possible = 0
+    history = autograder.HISTORY_HEAD
+    sandbox = True
+    read_only = True
+
+    def passed(self, result):
+        return result.message == 'rpn.py and test_rpn.py import'
+
+    def test(self, repo_path):
+        with autograder.snapshot(repo_path) as path:
+            try:
+                self.probe(path, imports_probe)
+            except sandbox.ProbeError as e:
+                return self.result('rpn.py or test_rpn.py does not import', 0,
+                        additional_text=str(e))
+        return self.result('rpn.py and test_rpn.py import', 0)
+
 class TestExponentiation(autograder.TestCase):
-    def get_lines(self, repo_path):
-        with sh.pushd(repo_path):
-            a = sh.python3('-c', ugly_one_liner)
-            lines = [x for x in a.stdout.decode('utf-8').split('\n') if '>>>' in x]
-            return lines
+    history = autograder.HISTORY_HEAD
+    sandbox = True
+    read_only = True
+    requires = (TestImports,)
+
+    # shared by all three TestExponentiation* cases, so it runs once per repo,
+    # in a snapshot since student code may write files
+    @autograder.fixture
+    def get_results(self, repo_path):
+        with autograder.snapshot(repo_path) as path:
+            return self.probe(path, exponentiation_probe)['value']
+
+    @staticmethod
+    def details(step):
+        if 'error' in step:
+            return step['error']
+        return 'Returned {}'.format(step['value'])
 
 class TestExponentiationGood(TestExponentiation):
     points_possible = 1
 
     def test(self, repo_path):
-        lines = self.get_lines(repo_path)
+        step = self.get_results(repo_path)['test']
 
-        if lines[1] == '>>> None':
-            return self.result('Test case passes valid exponentiation function', 1)
-        elif lines[1] == '>>> !! NO TEST FN':
+        if step is None:
             return self.result('Could not find test case for exponentiation', 0)
+        elif step.get('value') == 'None':
+            return self.result('Test case passes valid exponentiation function', 1)
         else:
             return self.result('Testing for valid exponentiation function failed',
-                               0, additional_text=lines[1].replace('ç', '\n'))
+                               0, additional_text=self.details(step))
 
 class TestExponentiationBad(TestExponentiation):
     points_possible = 1
 
     def test(self, repo_path):
-        lines = self.get_lines(repo_path)
+        step = self.get_results(repo_path)['patched_test']
 
-        if lines[3] == '>>> GoodFail':
-            return self.result('Test case catches bad exponentiation implementation', 1)
-        elif lines[3] == '>>> !! NO TEST FN':
+        if step is None:
             return self.result('Could not find test case for exponentiation', 0)
+        elif step.get('failed'):
+            return self.result('Test case catches bad exponentiation implementation', 1)
         else:
             return self.result('Testing that bad exponentiation function fails failed',
-                0, additional_text=lines[3].replace('ç', '\n'))
+                0, additional_text=self.details(step))
 
 class TestExponentiationImpl(TestExponentiation):
     points_possible = 1
 
     def test(self, repo_path):
-        lines = self.get_lines(repo_path)
+        step = self.get_results(repo_path)['calculate']
 
-        if lines[0] == '>>> 8' or lines[0] == '>>> 8.0':
+        if step.get('value') in ('8', '8.0'):
             return self.result('Exponentiation implementation correct', 1)
         else:
             return self.result('Testing student exponentiation function failed',
-                               0, additional_text=lines[0].replace('ç', '\n'))
+                               0, additional_text=self.details(step))
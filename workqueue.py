@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# A queue of submissions to grade, shared by a coordinator and any number of
+# workers on other machines through one SQLite file (on shared storage).
+#
+# Workers lease a job for a while and renew the lease as long as they're
+# working on it. A job whose lease runs out, say because its worker died,
+# goes back to whoever asks next, up to max_attempts times. Lease times are
+# wall-clock, so the machines' clocks should agree to within a lease.
+
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    uniq TEXT UNIQUE NOT NULL,
+    submission TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT
+)
+'''
+
+def encode_submission(submission):
+    return json.dumps(submission)
+
+def decode_submission(data):
+    # (url, path), or {name: (url, path)}; JSON turned the tuples into lists
+    submission = json.loads(data)
+    if isinstance(submission, dict):
+        return {name: tuple(repo) for name, repo in submission.items()}
+    return tuple(submission)
+
+class WorkQueue:
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self.transaction() as db:
+            db.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # a connection per transaction, so threads and forks never share one
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def enqueue(self, submissions, resume=False):
+        # Start over with just submissions, or with resume keep every job
+        # already in the queue, finished or not. Returns how many jobs were
+        # dropped.
+        with self.transaction() as db:
+            dropped = 0 if resume else db.execute('DELETE FROM jobs').rowcount
+            db.executemany('INSERT OR IGNORE INTO jobs (uniq, submission) VALUES (?, ?)',
+                [(uniq, encode_submission(submission))
+                    for uniq, submission in submissions.items()])
+        return dropped
+
+    def lease(self, worker, seconds):
+        # (seq, uniq, submission) of the next job that is pending, or whose
+        # lease expired with attempts to spare; None if there isn't one right
+        # now. seq tells this job apart from a later one for the same uniq.
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute('''SELECT seq, uniq, submission FROM jobs
+                WHERE attempts < ? AND (state = 'pending' OR
+                    (state = 'leased' AND lease_expires < ?))
+                ORDER BY seq LIMIT 1''', (self.max_attempts, now)).fetchone()
+            if row is None:
+                return None
+            db.execute('''UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?,
+                attempts = attempts + 1 WHERE seq = ?''', (worker, now + seconds, row[0]))
+        return row[0], row[1], decode_submission(row[2])
+
+    def renew(self, uniq, worker, seconds):
+        # False if the lease was lost to another worker
+        with self.transaction() as db:
+            return db.execute('''UPDATE jobs SET lease_expires = ?
+                WHERE uniq = ? AND worker = ? AND state = 'leased' ''',
+                (time.time() + seconds, uniq, worker)).rowcount == 1
+
+    @contextlib.contextmanager
+    def heartbeat(self, uniq, worker, seconds):
+        # keep renewing the lease in the background while the body runs
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(seconds / 3.):
+                self.renew(uniq, worker, seconds)
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, uniq, entry, seq=None):
+        # The first result in for a job wins, later ones (from a worker whose
+        # lease had expired) are dropped. With seq, so are results for a job
+        # the queue has been restarted since.
+        with self.transaction() as db:
+            db.execute('''UPDATE jobs SET state = 'done', result = ?
+                WHERE uniq = ? AND state != 'done' AND (? IS NULL OR seq = ?)''',
+                (json.dumps(entry), uniq, seq, seq))
+
+    def abandoned(self):
+        # jobs whose every attempt ran out of lease
+        with self.transaction() as db:
+            return [uniq for uniq, in db.execute('''SELECT uniq FROM jobs
+                WHERE state = 'leased' AND attempts >= ? AND lease_expires < ?''',
+                (self.max_attempts, time.time()))]
+
+    def results(self, uniqs=None):
+        # {uniq: results.json entry} of finished jobs, optionally only of uniqs
+        with self.transaction() as db:
+            rows = db.execute("SELECT uniq, result FROM jobs WHERE state = 'done'").fetchall()
+        return {uniq: json.loads(result) for uniq, result in rows
+            if uniqs is None or uniq in uniqs}
+
+    def finished(self):
+        # an empty queue isn't finished, its coordinator may not be up yet
+        with self.transaction() as db:
+            total, done = db.execute(
+                "SELECT COUNT(*), COUNT(result) FROM jobs").fetchone()
+        return total > 0 and done == total